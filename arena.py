@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import struct
+import hashlib
+import dataclasses
+from array import array
+from enum import Enum
+import astree
+from astree import ASTNode, LazyBlock, Name
+
+NODE_TYPES = tuple(cls for cls in vars(astree).values()
+                   if isinstance(cls, type) and issubclass(cls, ASTNode)
+                   and dataclasses.is_dataclass(cls) and cls is not LazyBlock)
+NODE_KINDS = {cls: kind for kind, cls in enumerate(NODE_TYPES)}
+NODE_FIELDS = tuple(tuple(f.name for f in dataclasses.fields(cls) if f.init) for cls in NODE_TYPES)
+ENUM_TYPES = {cls.__name__: cls for cls in vars(astree).values()
+              if isinstance(cls, type) and issubclass(cls, Enum) and cls is not Enum}
+
+class FieldProbe:
+    # Stands in for every field of a node so grab_primaries() reports which ones it descends into
+    def __init__(self, name):
+        self.name = name
+
+    def __iter__(self):
+        yield self
+
+    def grab_primaries(self):
+        return [self]
+
+def primary_fields(cls, fields):
+    if cls is Name or not hasattr(cls, "grab_primaries"):
+        return ()
+    probes = cls(*[FieldProbe(name) for name in fields]).grab_primaries()
+    return tuple(dict.fromkeys(probe.name for probe in probes))
+
+# Fields each node's grab_primaries() descends into, derived from astree so the two can't drift
+# apart. Name is handled on its own
+PRIMARY_FIELDS = {cls.__name__: primary_fields(cls, fields) for cls, fields in zip(NODE_TYPES, NODE_FIELDS)}
+PRIMARY_SLOTS = tuple(tuple(NODE_FIELDS[kind].index(name) for name in PRIMARY_FIELDS.get(cls.__name__, ()))
+                      for kind, cls in enumerate(NODE_TYPES))
+NAME_KIND = NODE_KINDS[Name]
+
+REF_NODE = 0
+REF_CONST = 1
+REF_LIST = 2
+REF_NONE = 3
+REF_DICT = 4
+REF_BITS = 3
+REF_MASK = (1 << REF_BITS) - 1
+
+ARENA_MAGIC = b"FFA\x01"
+ARENA_HEADER = struct.Struct("<4s16s6i")
+
+def layout_version():
+    digest = hashlib.sha256()
+    for cls, fields in zip(NODE_TYPES, NODE_FIELDS):
+        digest.update("{}({});".format(cls.__name__, ",".join(fields)).encode())
+    return digest.digest()[:16]
+
+def encode_const(value):
+    if isinstance(value, Enum):
+        return {"enum": type(value).__name__, "name": value.name}
+    return value
+
+def decode_const(value):
+    if isinstance(value, dict):
+        return ENUM_TYPES[value["enum"]][value["name"]]
+    return value
+
+class Arena:
+    def __init__(self):
+        self.kinds = array("B")
+        self.field_starts = array("i")
+        self.fields = array("i")
+        self.list_starts = array("i", [0])
+        self.list_items = array("i")
+        self.pool = []
+        self.pool_index = {}
+        self.views = {}
+        self.node_refs = {}
+
+    @classmethod
+    def from_ast(cls, node):
+        arena = cls()
+        arena.root = arena.add(node) >> REF_BITS
+        return arena
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def const(self, value):
+        key = (type(value), value)
+        index = self.pool_index.get(key)
+        if index is None:
+            index = len(self.pool)
+            self.pool.append(value)
+            self.pool_index[key] = index
+        return index << REF_BITS | REF_CONST
+
+    def add(self, value):
+        if value is None:
+            return REF_NONE
+        if isinstance(value, LazyBlock):
+            value = value.force()
+        if isinstance(value, ASTNode):
+            # Shared (hash-consed) nodes are stored once and referenced from every parent
+            ref = self.node_refs.get(id(value))
+            if ref is not None:
+                return ref
+            kind = NODE_KINDS[type(value)]
+            refs = [self.add(getattr(value, name)) for name in NODE_FIELDS[kind]]
+            index = len(self.kinds)
+            self.kinds.append(kind)
+            self.field_starts.append(len(self.fields))
+            self.fields.extend(refs)
+            ref = self.node_refs[id(value)] = index << REF_BITS | REF_NODE
+            return ref
+        if isinstance(value, list):
+            return self.add_list([self.add(item) for item in value]) << REF_BITS | REF_LIST
+        if isinstance(value, dict):
+            refs = []
+            for key, item in value.items():
+                refs.append(self.add(key))
+                refs.append(self.add(item))
+            return self.add_list(refs) << REF_BITS | REF_DICT
+        return self.const(value)
+
+    def add_list(self, refs):
+        index = len(self.list_starts) - 1
+        self.list_items.extend(refs)
+        self.list_starts.append(len(self.list_items))
+        return index
+
+    def kind(self, index):
+        return NODE_TYPES[self.kinds[index]]
+
+    def field(self, index, slot):
+        return self.fields[self.field_starts[index] + slot]
+
+    def list_refs(self, index):
+        return self.list_items[self.list_starts[index]:self.list_starts[index + 1]]
+
+    def value(self, ref):
+        tag = ref & REF_MASK
+        if tag == REF_NODE:
+            return self.node(ref >> REF_BITS)
+        elif tag == REF_CONST:
+            return self.pool[ref >> REF_BITS]
+        elif tag == REF_LIST:
+            return [self.value(item) for item in self.list_refs(ref >> REF_BITS)]
+        elif tag == REF_DICT:
+            items = [self.value(item) for item in self.list_refs(ref >> REF_BITS)]
+            return dict(zip(items[::2], items[1::2]))
+        return None
+
+    def node(self, index=None):
+        if index is None:
+            index = self.root
+        view = self.views.get(index)
+        if view is None:
+            kind = self.kinds[index]
+            start = self.field_starts[index]
+            args = [self.value(ref) for ref in self.fields[start:start + len(NODE_FIELDS[kind])]]
+            view = NODE_TYPES[kind](*args)
+            self.views[index] = view
+        return view
+
+    def children(self, ref):
+        tag = ref & REF_MASK
+        if tag == REF_NODE:
+            yield ref >> REF_BITS
+        elif tag == REF_LIST or tag == REF_DICT:
+            for item in self.list_refs(ref >> REF_BITS):
+                yield from self.children(item)
+
+    def walk(self, index=None):
+        stack = [self.root if index is None else index]
+        while stack:
+            index = stack.pop()
+            yield index
+            start = self.field_starts[index]
+            for ref in reversed(self.fields[start:start + len(NODE_FIELDS[self.kinds[index]])]):
+                stack.extend(reversed(list(self.children(ref))))
+
+    def grab_primaries(self, index=None):
+        primaries = []
+        stack = [self.root if index is None else index]
+        while stack:
+            index = stack.pop()
+            kind = self.kinds[index]
+            if kind == NAME_KIND:
+                primaries.append(self.pool[self.field(index, 0) >> REF_BITS])
+                continue
+            for slot in reversed(PRIMARY_SLOTS[kind]):
+                stack.extend(reversed(list(self.children(self.field(index, slot)))))
+        return primaries
+
+    def to_bytes(self):
+        pool = json.dumps([encode_const(value) for value in self.pool]).encode()
+        header = ARENA_HEADER.pack(ARENA_MAGIC, layout_version(), self.root, len(self.kinds),
+                                   len(self.fields), len(self.list_starts), len(self.list_items), len(pool))
+        return b"".join((header, self.field_starts.tobytes(), self.fields.tobytes(),
+                         self.list_starts.tobytes(), self.list_items.tobytes(), self.kinds.tobytes(), pool))
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, root, nodes, fields, lists, items, pool = ARENA_HEADER.unpack_from(data)
+        if magic != ARENA_MAGIC or version != layout_version():
+            raise ValueError("Not an arena for this AST layout")
+        arena = cls()
+        arena.root = root
+        view = memoryview(data)
+        pos = ARENA_HEADER.size
+        columns = []
+        for count, fmt in ((nodes, "i"), (fields, "i"), (lists, "i"), (items, "i"), (nodes, "B")):
+            size = count * struct.calcsize(fmt)
+            columns.append(view[pos:pos + size].cast(fmt))
+            pos += size
+        arena.field_starts, arena.fields, arena.list_starts, arena.list_items, arena.kinds = columns
+        arena.pool = [decode_const(value) for value in json.loads(bytes(view[pos:pos + pool]))]
+        return arena
+
+if __name__ == "__main__":
+    import pickle
+    from lex import mapped_source
+    from parser import Parser
+    for script_path in sys.argv[1:]:
+        with mapped_source(script_path) as source:
+            parser = Parser(source)
+            parser.lexer.lex()
+            ast = astree.ExprList(list(parser.top_exprs()))
+        arena = Arena.from_ast(ast)
+        print("{}: {} nodes, {} constants, {} bytes as an arena, {} bytes pickled".format(
+            script_path, len(arena), len(arena.pool), len(arena.to_bytes()),
+            len(pickle.dumps(ast, pickle.HIGHEST_PROTOCOL))))
@@ -77,7 +77,7 @@ class SymbolTable:
     def print_keys(self, level=0):
         return "{}: {}{}".format(level, self.symbols.keys(), ", {}".format(self.parent.print_keys(level=level+1) if self.parent is not None else ""))
 
-@dataclass
+@dataclass(slots=True)
 class ASTNode:
     def eval(self, symbol_table):
         raise Exception("eval() for {} not yet implemented".format(type(self).__name__))
@@ -197,7 +197,7 @@ class InterpObj:
                 return True
         return False
 
-@dataclass
+@dataclass(slots=True)
 class ExprList(ASTNode):
     exprs: 'list'
     def eval(self, symbol_table):
@@ -224,11 +224,11 @@ class ExprList(ASTNode):
             ret_primaries.extend(expr.grab_primaries())
         return ret_primaries
 
-@dataclass
+@dataclass(slots=True)
 class Expr(ASTNode):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class EmptyExpr(Expr):
     def eval(self, symbol_table):
         return
@@ -239,10 +239,11 @@ class EmptyExpr(Expr):
     def grab_primaries(self):
         return []
 
-@dataclass
+@dataclass(slots=True)
 class Block(Expr):
     label: str
     exprs: ExprList
+    scope: None = field(default=None, init=False, repr=False, compare=False)
 
     def lprint(self):
         return "{}{{{}}}".format("" if self.label is None else "{}:".format(self.label), self.exprs.lprint())
@@ -261,12 +262,47 @@ class Block(Expr):
     def grab_primaries(self):
         return self.exprs.grab_primaries()
 
+def forced_block(block):
+    return block
+
+@dataclass(slots=True)
+class LazyBlock(Expr):
+    start: int
+    end: int
+    names: list
+    parser: None = field(default=None, repr=False, compare=False)
+    body: Block = field(default=None, repr=False, compare=False)
+
+    def force(self):
+        if self.body is None:
+            self.body = self.parser.parse_lazy(self)
+            self.parser = None
+        return self.body
+
+    def __reduce__(self):
+        return (forced_block, (self.force(),))
+
+    def lprint(self):
+        return self.force().lprint()
+
+    def eval(self, symbol_table):
+        return self.force().eval(symbol_table)
+
+    def visit(self, interp, **kwargs):
+        return self.force().visit(interp, **kwargs)
+
+    def grab_primaries(self):
+        if self.body is not None:
+            return self.body.grab_primaries()
+        return list(self.names)
+
 class Primary(Expr):
-    pass
+    __slots__ = ()
 
-@dataclass
+@dataclass(slots=True)
 class Name(Primary):
     name: str
+    address: tuple = field(default=None, init=False, repr=False, compare=False)
 
     def lprint(self):
         return self.name
@@ -280,7 +316,7 @@ class Name(Primary):
     def grab_primaries(self):
         return [self.name]
 
-@dataclass
+@dataclass(slots=True)
 class Literal(Primary):
     pass
 
@@ -293,56 +329,56 @@ class Literal(Primary):
     def grab_primaries(self):
         return []
 
-@dataclass
+@dataclass(slots=True)
 class StringLiteral(Literal):
     value: str
 
     def visit(self, interp, **kwargs):
         return interp.stringlit(self, **kwargs)
 
-@dataclass
+@dataclass(slots=True)
 class IntLiteral(Literal):
     value: int
 
     def visit(self, interp, **kwargs):
         return interp.intlit(self, **kwargs)
 
-@dataclass
+@dataclass(slots=True)
 class FloatLiteral(Literal):
     value: float
 
     def visit(self, interp, **kwargs):
         return interp.floatlit(self, **kwargs)
 
-@dataclass
+@dataclass(slots=True)
 class BoolLiteral(Literal):
     value: bool
 
     def visit(self, interp, **kwargs):
         return interp.boollit(self, **kwargs)
 
-@dataclass
+@dataclass(slots=True)
 class NullLiteral(Literal):
     value: None
 
     def visit(self, interp, **kwargs):
         return interp.nulllit(self, **kwargs)
 
-@dataclass
+@dataclass(slots=True)
 class ArrayLiteral(Literal):
     value: list
 
     def visit(self, interp, **kwargs):
         return interp.arraylit(self, **kwargs)
 
-@dataclass
+@dataclass(slots=True)
 class DictLiteral(Literal):
     value: dict
 
     def visit(self, interp, **kwargs):
         return interp.dictlit(self, **kwargs)
 
-@dataclass
+@dataclass(slots=True)
 class Call(Expr):
     args: 'list'
 
@@ -362,7 +398,7 @@ class Call(Expr):
             ret_primaries.extend(arg.grab_primaries())
         return ret_primaries
 
-@dataclass
+@dataclass(slots=True)
 class Slice(Expr):
     pass
 
@@ -372,7 +408,7 @@ class Slice(Expr):
     def grab_primaries(self):
         return []
 
-@dataclass
+@dataclass(slots=True)
 class Field(Expr):
     name: Name
 
@@ -394,7 +430,7 @@ class Field(Expr):
     def grab_primaries(self):
         return []
 
-@dataclass
+@dataclass(slots=True)
 class Accessor(Expr):
     access_type: Call | Slice | Field
     next_accessor: 'Accessor'
@@ -419,7 +455,7 @@ class Accessor(Expr):
             ret_primaries.extend(self.next_accessor.grab_primaries())
         return ret_primaries
 
-@dataclass
+@dataclass(slots=True)
 class Primary(Expr):
     target: Name | Literal
     accessor: 'Accessor'
@@ -457,7 +493,7 @@ class Primary(Expr):
 class AssignOp(Enum):
     NORMAL = auto()
 
-@dataclass
+@dataclass(slots=True)
 class AssignExpr(Expr):
     target: Primary
     operator: AssignOp
@@ -506,7 +542,7 @@ class BinOp(Enum):
     AND = auto()
     OR = auto()
 
-@dataclass
+@dataclass(slots=True)
 class BinExpr(Expr):
     lhs: Expr
     operator: BinOp
@@ -594,7 +630,7 @@ class UnOp(Enum):
     INV = auto()
     NOT = auto()
 
-@dataclass
+@dataclass(slots=True)
 class UnExpr(Expr):
     operator: UnOp
     rhs: Expr
@@ -622,7 +658,7 @@ class UnExpr(Expr):
     def grab_primaries(self):
         return self.rhs.grab_primaries()
 
-@dataclass
+@dataclass(slots=True)
 class SingleKWExpr(Expr):
     target: Expr | None
     expr: Expr | None
@@ -633,7 +669,7 @@ class SingleKWExpr(Expr):
         else:
             return self.expr.grab_primaries()
 
-@dataclass
+@dataclass(slots=True)
 class ReturnExpr(SingleKWExpr):
     def lprint(self):
         return "({} {}{})".format("return", "" if self.expr is None else self.expr.lprint(), "" if self.target is None else " to {}".format(self.target.lprint()))
@@ -650,7 +686,7 @@ class ReturnExpr(SingleKWExpr):
     def visit(self, interp):
         return interp.returnexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class BreakExpr(SingleKWExpr):
     def lprint(self):
         return "({} {}{})".format("break", "" if self.expr is None else self.expr.lprint(), "" if self.target is None else " to {}".format(self.target.lprint()))
@@ -665,7 +701,7 @@ class BreakExpr(SingleKWExpr):
     def visit(self, interp):
         return interp.breakexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class ContinueExpr(SingleKWExpr):
     def lprint(self):
         return "({} {}{})".format("continue", "" if self.expr is None else self.expr.lprint(), "" if self.target is None else " to {}".format(self.target.lprint()))
@@ -680,7 +716,7 @@ class ContinueExpr(SingleKWExpr):
     def visit(self, interp):
         return interp.continueexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class LeaveExpr(SingleKWExpr):
     def lprint(self):
         return "({} {}{})".format("leave", "" if self.expr is None else self.expr.lprint(), "" if self.target is None else " to {}".format(self.target.lprint()))
@@ -695,7 +731,7 @@ class LeaveExpr(SingleKWExpr):
     def visit(self, interp):
         return interp.leaveexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class DeferExpr(SingleKWExpr):
     def lprint(self):
         return "({} {}{})".format("defer", "" if self.expr is None else self.expr.lprint(), "" if self.target is None else " to {}".format(self.target.lprint()))
@@ -706,7 +742,7 @@ class DeferExpr(SingleKWExpr):
     def visit(self, interp):
         return interp.deferexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class YieldExpr(SingleKWExpr):
     def lprint(self):
         return "({} {}{})".format("yield", self.expr.lprint(), "" if self.target is None else " to {}".format(self.target.lprint()))
@@ -714,7 +750,7 @@ class YieldExpr(SingleKWExpr):
     def visit(self, interp):
         return interp.yieldexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class IfExpr(Expr):
     guard: Expr
     expr: Expr
@@ -744,7 +780,7 @@ class IfExpr(Expr):
             ret_primaries.extend(self.elexpr.grab_primaries())
         return ret_primaries
 
-@dataclass
+@dataclass(slots=True)
 class ElseExpr(Expr):
     expr: Expr
 
@@ -765,7 +801,7 @@ class ClassType(Enum):
     STATIC = auto()
     TRAIT = auto()
 
-@dataclass
+@dataclass(slots=True)
 class ClassDecl(Expr):
     class_type: ClassType
     name: Name
@@ -815,11 +851,12 @@ class ClassDecl(Expr):
     def grab_primaries(self):
         return self.expr.grab_primaries()
 
-@dataclass
+@dataclass(slots=True)
 class FnDecl(Expr):
     name: Name
     args: None
     expr: Expr
+    scope: None = field(default=None, init=False, repr=False, compare=False)
 
     def lprint(self):
         return "(fn {} ({}) {})".format("" if self.name is None else "{}".format(self.name.lprint()),
@@ -846,7 +883,7 @@ class FnDecl(Expr):
     def grab_primaries(self):
         return self.expr.grab_primaries()
 
-@dataclass
+@dataclass(slots=True)
 class MatchExpr(Expr):
     init_expr: Expr
     cases: 'list'
@@ -857,7 +894,7 @@ class MatchExpr(Expr):
     def visit(self, interp):
         return interp.matchexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class CaseExpr(Expr):
     match: Expr
     expr: Expr
@@ -869,12 +906,13 @@ class CaseExpr(Expr):
     def visit(self, interp):
         return interp.caseexpr(self)
 
-@dataclass
+@dataclass(slots=True)
 class ForExpr(Expr):
     iter_name: Name
     iter_expr: Expr
     expr: Expr
     elexpr: None = None
+    scope: None = field(default=None, init=False, repr=False, compare=False)
 
     def lprint(self):
         return "(for {} in {} {} {})".format(self.iter_name.lprint(), self.iter_expr, self.expr.lprint(), self.elexpr.lprint() if self.elexpr is not None else "")
@@ -912,11 +950,12 @@ class ForExpr(Expr):
             ret_primaries.extend(self.elexpr.grab_primaries())
         return ret_primaries
 
-@dataclass
+@dataclass(slots=True)
 class WhileExpr(Expr):
     guard: Expr
     expr: Expr
     elexpr: None = None
+    scope: None = field(default=None, init=False, repr=False, compare=False)
 
     def lprint(self):
         return "(while {} {} {})".format(self.guard.lprint(), self.expr.lprint(), self.elexpr.lprint() if self.elexpr is not None else "")
@@ -948,10 +987,11 @@ class WhileExpr(Expr):
             ret_primaries.extend(self.elexpr.grab_primaries())
         return ret_primaries
 
-@dataclass
+@dataclass(slots=True)
 class DoWhileExpr(Expr):
     guard: Expr
     expr: Expr
+    scope: None = field(default=None, init=False, repr=False, compare=False)
 
     def lprint(self):
         return "(do {} while {})".format(self.expr.lprint(), self.guard.lprint())
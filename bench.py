@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import sys
+import os
+import glob
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from lex import Lexer, LEX_ENGINES
+
+CORPUS_LINES = {
+    "identifiers": "alpha_{0} = beta_{0} + gamma_{0}.delta(epsilon, zeta_{0})\n",
+    "numbers": "n{0} = 0xDEAD_BEEF + 0o7_55 - 0b1010_0101 * 1_000_000 / 3.141_59\n",
+    "strings": "s{0} = \"" + "long string literal with 'quotes' and \\\"escapes\\\" " * 8 + "\"\n",
+    "comments": "# {0} a comment line that the lexer has to skip over entirely, = + - * / ( ) [ ]\n",
+    "operators": "a{0}=b+c-d*e**f//g%h<<i>>j&k|l^m==n!=o<=p>=q<r>s~t\n",
+}
+
+DEFAULT_SIZES = [1000, 100000]
+
+def token_count(source):
+    return len(Lexer(source).lex())
+
+def synthetic_corpus(kind, tokens):
+    line = CORPUS_LINES[kind]
+    line_tokens = token_count(line.format(0)) - 1
+    lines = max(1, -(-tokens // line_tokens))
+    return "".join(line.format(i) for i in range(lines))
+
+def example_corpus():
+    sources = []
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ex", "*.ff"))):
+        with open(path) as source_file:
+            sources.append(source_file.read())
+    return "\n".join(sources)
+
+def lex_once(source, engine):
+    lexer = Lexer(source, engine)
+    start = time.perf_counter()
+    tokens = len(lexer.lex())
+    return tokens, time.perf_counter() - start
+
+def peak_memory(source, engine):
+    tracemalloc.start()
+    lexer = Lexer(source, engine)
+    lexer.lex()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def bench(name, source, engine, repeat):
+    best = None
+    tokens = 0
+    for i in range(repeat):
+        tokens, elapsed = lex_once(source, engine)
+        if best is None or elapsed < best:
+            best = elapsed
+    source_bytes = len(source.encode("utf-8"))
+    return {
+        "corpus": name,
+        "engine": engine,
+        "tokens": tokens,
+        "bytes": source_bytes,
+        "seconds": best,
+        "tokens_per_sec": tokens / best if best else None,
+        "bytes_per_sec": source_bytes / best if best else None,
+        "peak_memory": peak_memory(source, engine) if engine != "parallel" else None,
+    }
+
+def main(argv):
+    argparser = argparse.ArgumentParser(description="Measure foxscream lexer throughput")
+    argparser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                           help="target token counts for the synthetic corpora")
+    argparser.add_argument("--corpora", nargs="+", default=list(CORPUS_LINES) + ["examples"],
+                           choices=list(CORPUS_LINES) + ["examples"])
+    argparser.add_argument("--engines", nargs="+", default=["regex", "classic"], choices=LEX_ENGINES)
+    argparser.add_argument("--repeat", type=int, default=3)
+    argparser.add_argument("-o", "--output", help="write JSON results here instead of stdout")
+    args = argparser.parse_args(argv)
+
+    results = []
+    for kind in args.corpora:
+        if kind == "examples":
+            cases = [("examples", example_corpus())]
+        else:
+            cases = [("{}_{}".format(kind, size), synthetic_corpus(kind, size)) for size in args.sizes]
+        for name, source in cases:
+            for engine in args.engines:
+                result = bench(name, source, engine, args.repeat)
+                print("{corpus:>24} {engine:>8} {tokens:>10} tokens {tokens_per_sec:>14,.0f} tok/s {bytes_per_sec:>16,.0f} B/s".format(**result),
+                      file=sys.stderr)
+                results.append(result)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
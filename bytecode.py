@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+
+import sys
+from dataclasses import dataclass, field
+from astree import BinOp, Name, ExprList
+from runtime import FSFunc, UNBOUND, literal_literal
+from runtime import BINARY_FUNCS, UNARY_FUNCS
+
+OPNAMES = (
+    "LOAD_CONST",
+    "LOAD_LOCAL",
+    "STORE_LOCAL",
+    "BIND_LOCAL",
+    "LOAD_GLOBAL",
+    "STORE_GLOBAL",
+    "POP",
+    "POP_TO",
+    "JUMP",
+    "POP_JUMP_IF_NOT_TRUE",
+    "AND_TEST",
+    "OR_TEST",
+    "VALUE_OF",
+    "BINARY_OP",
+    "UNARY_OP",
+    "GET_ITER",
+    "FOR_START",
+    "FOR_NEXT",
+    "CALL",
+    "BUILD_ARRAY",
+    "BUILD_DICT",
+    "MAKE_FUNCTION",
+    "DEFER",
+    "RUN_DEFERS",
+    "END_DEFER",
+    "RETURN",
+    "RAISE",
+)
+
+for opcode, opname in enumerate(OPNAMES):
+    globals()[opname] = opcode
+
+JUMP_OPS = {JUMP, POP_JUMP_IF_NOT_TRUE, AND_TEST, OR_TEST, FOR_START, FOR_NEXT}
+
+STACK_EFFECTS = {
+    LOAD_CONST: 1,
+    LOAD_LOCAL: 1,
+    STORE_LOCAL: 0,
+    BIND_LOCAL: -1,
+    LOAD_GLOBAL: 1,
+    STORE_GLOBAL: 0,
+    POP: -1,
+    JUMP: 0,
+    POP_JUMP_IF_NOT_TRUE: -1,
+    VALUE_OF: 0,
+    BINARY_OP: -1,
+    UNARY_OP: 0,
+    GET_ITER: 0,
+    MAKE_FUNCTION: 1,
+    DEFER: 0,
+    RUN_DEFERS: 0,
+    END_DEFER: 0,
+    RETURN: 0,
+    RAISE: 1,
+}
+
+BINARY_OPS = list(BINARY_FUNCS.values())
+BINARY_INDEX = {op: i for i, op in enumerate(BINARY_FUNCS.keys())}
+UNARY_OPS = list(UNARY_FUNCS.values())
+UNARY_INDEX = {op: i for i, op in enumerate(UNARY_FUNCS.keys())}
+
+@dataclass
+class Code:
+    name: str
+    ops: list
+    consts: list
+    names: list
+    local_names: list
+    local_index: dict
+    arg_slots: list
+    initial: list = field(repr=False)
+
+    def lprint(self):
+        lines = ["code {}".format(self.name)]
+        for pc in range(0, len(self.ops), 2):
+            op = self.ops[pc]
+            arg = self.ops[pc + 1]
+            note = ""
+            if op in (LOAD_CONST, MAKE_FUNCTION, BUILD_DICT, RAISE):
+                note = repr(self.consts[arg])
+            elif op in (LOAD_GLOBAL, STORE_GLOBAL):
+                note = self.names[arg]
+            elif op in (LOAD_LOCAL, STORE_LOCAL, BIND_LOCAL, DEFER, RUN_DEFERS):
+                note = self.local_names[arg]
+            lines.append("{:5} {:22} {:5} {}".format(pc, OPNAMES[op], arg, note).rstrip())
+        return "\n".join(lines)
+
+@dataclass
+class FunctionProto:
+    name: str
+    args: list
+    body: None = field(repr=False)
+    captures: list = field(repr=False)
+    code: Code = field(default=None, repr=False)
+
+    def compile(self, environment):
+        if self.code is None:
+            self.code = Compiler(environment).compile_function(self)
+        return self.code
+
+    def __repr__(self):
+        return "<fn {}>".format("anonymous" if self.name is None else self.name)
+
+@dataclass
+class Control:
+    kind: str
+    depth: int
+    end: int
+    cont: int = None
+    cont_depth: int = None
+    label: str = None
+    explicit: bool = True
+    body: None = None
+    loop: 'Control' = None
+    defer_slot: int = None
+
+class Compiler:
+    def __init__(self, environment):
+        self.environment = environment
+        self.ops = []
+        self.consts = []
+        self.const_index = {}
+        self.names = []
+        self.name_index = {}
+        self.local_names = []
+        self.local_index = {}
+        self.initial = []
+        self.labels = []
+        self.controls = []
+        self.depth = 0
+        self.top_level = True
+
+    def compile(self, node, name="<top>"):
+        self.compile_node(node)
+        self.emit(RETURN, 0)
+        return self.finish(name, [])
+
+    def compile_function(self, proto):
+        self.top_level = False
+        arg_slots = [self.local(arg) for arg in proto.args]
+        for name in proto.captures:
+            self.local(name)
+        self.compile_node(proto.body)
+        self.emit(RETURN, 0)
+        return self.finish("<fn>" if proto.name is None else proto.name, arg_slots)
+
+    def finish(self, name, arg_slots):
+        ops = self.ops
+        for pc in range(0, len(ops), 2):
+            if ops[pc] in JUMP_OPS:
+                ops[pc + 1] = self.labels[ops[pc + 1]]
+        return Code(name, ops, self.consts, self.names, self.local_names,
+                    self.local_index, arg_slots, self.initial)
+
+    def compile_node(self, node):
+        return node.visit(self)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def unsupported(node, **kwargs):
+            self.error("{} is not supported yet".format(type(node).__name__))
+        return unsupported
+
+    def emit(self, op, arg=0, effect=None):
+        self.ops.append(op)
+        self.ops.append(arg)
+        self.depth += STACK_EFFECTS[op] if effect is None else effect
+
+    def label(self):
+        self.labels.append(None)
+        return len(self.labels) - 1
+
+    def mark(self, label, depth=None):
+        self.labels[label] = len(self.ops)
+        if depth is not None:
+            self.depth = depth
+
+    def const(self, value, key=None):
+        if key is None:
+            self.consts.append(value)
+            return len(self.consts) - 1
+        if key not in self.const_index:
+            self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return self.const_index[key]
+
+    def load_const(self, value, key=None):
+        self.emit(LOAD_CONST, self.const(value, key))
+
+    def local(self, name):
+        if name not in self.local_index:
+            self.local_index[name] = len(self.local_names)
+            self.local_names.append(name)
+            self.initial.append(UNBOUND)
+        return self.local_index[name]
+
+    def hidden_local(self, name):
+        self.local_names.append(name)
+        self.initial.append(None)
+        return len(self.local_names) - 1
+
+    def global_name(self, name):
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return self.name_index[name]
+
+    def error(self, message):
+        self.emit(RAISE, self.const(message))
+
+    def load_name(self, name):
+        if self.top_level:
+            self.emit(LOAD_GLOBAL, self.global_name(name))
+        else:
+            self.emit(LOAD_LOCAL, self.local(name))
+
+    def store_name(self, name):
+        if self.top_level:
+            self.emit(STORE_GLOBAL, self.global_name(name))
+        else:
+            self.emit(STORE_LOCAL, self.local(name))
+
+    def bind_name(self, name):
+        if self.top_level:
+            self.emit(STORE_GLOBAL, self.global_name(name))
+            self.emit(POP)
+        else:
+            self.emit(BIND_LOCAL, self.local(name))
+
+    def constant(self, value, literal_type):
+        self.load_const(literal_literal(self.environment, value, literal_type), (literal_type, value))
+
+    def stringlit(self, string_ele):
+        self.constant(string_ele.value, "str")
+
+    def intlit(self, int_ele):
+        self.load_const(int_ele.value, ("int", int_ele.value))
+
+    def floatlit(self, float_ele):
+        self.load_const(float_ele.value, ("float", float_ele.value))
+
+    def arraylit(self, array_ele):
+        for item in array_ele.value:
+            self.compile_node(item)
+        self.emit(BUILD_ARRAY, len(array_ele.value), effect=1 - len(array_ele.value))
+
+    def dictlit(self, dict_ele):
+        for value in dict_ele.value.values():
+            self.compile_node(value)
+        keys = tuple(dict_ele.value.keys())
+        self.emit(BUILD_DICT, self.const(keys), effect=1 - len(keys))
+
+    def boollit(self, bool_ele):
+        self.load_const(bool_ele.value, "true" if bool_ele.value is True else "false")
+
+    def nulllit(self, null_ele):
+        self.load_const(self.environment.get("null"), "null")
+
+    def name(self, name_ele):
+        self.load_name(name_ele.name)
+
+    def primary(self, primary_ele):
+        self.compile_node(primary_ele.target)
+        accessor = primary_ele.accessor
+        while accessor is not None:
+            self.compile_node(accessor.access_type)
+            accessor = accessor.next_accessor
+
+    def call(self, call_ele):
+        for arg in call_ele.args:
+            self.compile_node(arg)
+        self.emit(CALL, len(call_ele.args), effect=-len(call_ele.args))
+
+    def field(self, field_ele):
+        self.emit(POP)
+        self.error("Field is not supported yet")
+
+    def slice(self, slice_ele):
+        self.emit(POP)
+        self.error("Slice is not supported yet")
+
+    def exprlist(self, exprlist_ele):
+        if not exprlist_ele.exprs:
+            self.load_const(None, "None")
+        for i, expr in enumerate(exprlist_ele.exprs):
+            if i > 0:
+                self.emit(POP)
+            self.compile_node(expr)
+
+    def assign(self, assign_ele):
+        self.compile_node(assign_ele.expr)
+        target = assign_ele.target
+        if target.accessor is not None:
+            self.emit(POP)
+            self.compile_node(target)
+        elif not isinstance(target.target, Name):
+            self.emit(POP)
+            self.error("Cannot assign to {}".format(target.target.lprint()))
+        else:
+            self.store_name(target.target.name)
+
+    def binexpr(self, binexpr_ele):
+        operator = binexpr_ele.operator
+        if operator == BinOp.AND or operator == BinOp.OR:
+            end = self.label()
+            self.compile_node(binexpr_ele.lhs)
+            self.emit(AND_TEST if operator == BinOp.AND else OR_TEST, end, effect=-1)
+            self.compile_node(binexpr_ele.rhs)
+            self.emit(VALUE_OF)
+            self.mark(end)
+        elif operator in BINARY_INDEX:
+            self.compile_node(binexpr_ele.lhs)
+            self.compile_node(binexpr_ele.rhs)
+            self.emit(BINARY_OP, BINARY_INDEX[operator])
+        else:
+            self.error("Unimplemented operator")
+
+    def unexpr(self, unexpr_ele):
+        if unexpr_ele.operator not in UNARY_INDEX:
+            self.error("unimplemented")
+            return
+        self.compile_node(unexpr_ele.rhs)
+        self.emit(UNARY_OP, UNARY_INDEX[unexpr_ele.operator])
+
+    def ifexpr(self, ifexpr_ele):
+        orelse = self.label()
+        end = self.label()
+        self.compile_node(ifexpr_ele.guard)
+        self.emit(POP_JUMP_IF_NOT_TRUE, orelse)
+        depth = self.depth
+        self.compile_node(ifexpr_ele.expr)
+        self.emit(JUMP, end)
+        self.mark(orelse, depth)
+        if ifexpr_ele.elexpr is not None:
+            self.compile_node(ifexpr_ele.elexpr)
+        else:
+            self.load_const(None, "None")
+        self.mark(end)
+
+    def elseexpr(self, elseexpr_ele):
+        self.compile_node(elseexpr_ele.expr)
+
+    def loop_else(self, elexpr):
+        if elexpr is not None:
+            self.compile_node(elexpr)
+        else:
+            self.load_const(self.environment.get("null"), "null")
+
+    def forexpr(self, forexpr_ele):
+        depth = self.depth
+        top = self.label()
+        orelse = self.label()
+        loop = Control("loop", depth, self.label(), cont=self.label(), cont_depth=depth + 1,
+                       body=forexpr_ele.expr)
+        self.compile_node(forexpr_ele.iter_expr)
+        self.emit(GET_ITER)
+        self.emit(FOR_START, orelse, effect=1)
+        self.mark(top)
+        self.bind_name(forexpr_ele.iter_name.name)
+        self.controls.append(loop)
+        self.compile_node(forexpr_ele.expr)
+        self.controls.pop()
+        self.mark(loop.cont)
+        self.emit(FOR_NEXT, top, effect=-1)
+        self.emit(JUMP, loop.end)
+        self.mark(orelse, depth)
+        self.loop_else(forexpr_ele.elexpr)
+        self.mark(loop.end)
+
+    def whileexpr(self, whileexpr_ele):
+        depth = self.depth
+        top = self.label()
+        orelse = self.label()
+        loop = Control("loop", depth, self.label(), cont=self.label(), cont_depth=depth,
+                       body=whileexpr_ele.expr)
+        self.compile_node(whileexpr_ele.guard)
+        self.emit(POP_JUMP_IF_NOT_TRUE, orelse)
+        self.mark(top)
+        self.controls.append(loop)
+        self.compile_node(whileexpr_ele.expr)
+        self.controls.pop()
+        self.mark(loop.cont)
+        self.compile_node(whileexpr_ele.guard)
+        self.emit(POP_JUMP_IF_NOT_TRUE, loop.end)
+        self.emit(POP)
+        self.emit(JUMP, top)
+        self.mark(orelse, depth)
+        self.loop_else(whileexpr_ele.elexpr)
+        self.mark(loop.end)
+
+    def dowhileexpr(self, dowhileexpr_ele):
+        depth = self.depth
+        top = self.label()
+        loop = Control("loop", depth, self.label(), cont=self.label(), cont_depth=depth,
+                       body=dowhileexpr_ele.expr)
+        self.mark(top)
+        self.controls.append(loop)
+        self.compile_node(dowhileexpr_ele.expr)
+        self.controls.pop()
+        self.mark(loop.cont)
+        self.compile_node(dowhileexpr_ele.guard)
+        self.emit(POP_JUMP_IF_NOT_TRUE, loop.end)
+        self.emit(POP)
+        self.emit(JUMP, top)
+        self.mark(loop.end, depth + 1)
+
+    def block(self, block_ele):
+        label = None if block_ele.label is None else block_ele.label.name
+        block = Control("block", self.depth, self.label(), label=label,
+                        explicit=isinstance(block_ele.exprs, ExprList))
+        if self.controls and self.controls[-1].body is block_ele:
+            block.loop = self.controls[-1]
+        self.controls.append(block)
+        self.compile_node(block_ele.exprs)
+        self.controls.pop()
+        if block.defer_slot is not None:
+            self.emit(RUN_DEFERS, block.defer_slot)
+        self.mark(block.end)
+
+    def find_control(self, kind, label=None):
+        for control in reversed(self.controls):
+            if label is not None:
+                if control.label == label:
+                    return control
+            elif kind == "loop" and control.kind == "loop":
+                return control
+            elif kind == "block" and control.kind == "block" and control.explicit:
+                return control.loop if control.loop is not None else control
+        return None
+
+    def exit_to(self, target, cont=False):
+        depth = target.cont_depth if cont else target.depth
+        if self.depth - 1 > depth:
+            self.emit(POP_TO, depth, effect=depth + 1 - self.depth)
+        for control in reversed(self.controls):
+            if control is target and cont:
+                break
+            if control.defer_slot is not None:
+                self.emit(RUN_DEFERS, control.defer_slot)
+            if control is target:
+                break
+        self.emit(JUMP, target.cont if cont else target.end)
+
+    def jumpexpr(self, node, kind, keyword, cont=False):
+        depth = self.depth
+        label = None if node.target is None else node.target.name
+        target = self.find_control(kind, label)
+        if target is None:
+            if label is None:
+                self.error("{} outside of a {}".format(keyword, kind))
+            else:
+                self.error("No labeled block " + label)
+            return
+        if cont and target.kind != "loop":
+            self.error("{} to a labeled block is not supported yet".format(keyword))
+            return
+        if node.expr is not None:
+            self.compile_node(node.expr)
+        else:
+            self.load_const(None, "None")
+        self.exit_to(target, cont)
+        self.depth = depth + 1
+
+    def breakexpr(self, break_ele):
+        self.jumpexpr(break_ele, "loop", "break")
+
+    def continueexpr(self, continue_ele):
+        self.jumpexpr(continue_ele, "loop", "continue", cont=True)
+
+    def leaveexpr(self, leave_ele):
+        self.jumpexpr(leave_ele, "block", "leave")
+
+    def returnexpr(self, return_ele):
+        if return_ele.expr is not None:
+            self.compile_node(return_ele.expr)
+        else:
+            self.load_const(None, "None")
+        for control in reversed(self.controls):
+            if control.defer_slot is not None:
+                self.emit(RUN_DEFERS, control.defer_slot)
+        self.emit(RETURN, 1)
+
+    def deferexpr(self, defer_ele):
+        block = None
+        for control in reversed(self.controls):
+            if control.kind == "block":
+                block = control
+                break
+        if block is None or defer_ele.expr is None:
+            self.load_const(None, "None")
+            return
+        if block.defer_slot is None:
+            block.defer_slot = self.hidden_local("<defer>")
+        skip = self.label()
+        self.emit(DEFER, block.defer_slot)
+        self.emit(JUMP, skip)
+        controls, depth = self.controls, self.depth
+        self.controls = []
+        self.compile_node(defer_ele.expr)
+        self.emit(END_DEFER)
+        self.controls = controls
+        self.mark(skip, depth)
+        self.load_const(None, "None")
+
+    def fndecl(self, fndecl_ele):
+        name = None if fndecl_ele.name is None else fndecl_ele.name.name
+        args = [x.target.name for x in fndecl_ele.args]
+        body = fndecl_ele.expr
+        proto = FunctionProto(name, args, body, body.grab_primaries())
+        if name is not None:
+            self.load_const(FSFunc(args, body, code=proto))
+            self.store_name(name)
+            self.emit(POP)
+        self.emit(MAKE_FUNCTION, self.const(proto))
+
+    def classdecl(self, classdecl_ele):
+        name = None if classdecl_ele.name is None else classdecl_ele.name.name
+        self.load_const(print)
+        self.load_const("classdecl")
+        self.load_const(name)
+        self.emit(CALL, 2, effect=-2)
+        self.emit(POP)
+        self.error("not done yet")
+
+if __name__ == "__main__":
+    from interp import Interpreter
+    interp = Interpreter()
+    print(Compiler(interp.get_prelude()).compile(interp.parse_file(sys.argv[1])).lprint())
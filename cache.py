@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import stat
+import zlib
+import struct
+import glob
+import hashlib
+import dataclasses
+import re
+from pickle import PicklingError
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from lex import NameTable, TokenType, RESERVED_WORDS, RESERVED_WORDS_BYTES, is_binary, mapped_source
+from parser import Parser
+from astree import ASTNode, ExprList, Name
+from arena import Arena
+
+CACHE_MAGIC = b"FFC\x02"
+CACHE_DIR_NAME = "__ffcache__"
+CACHE_DIR_ENV = "FOXSCREAM_CACHE_DIR"
+
+SEGMENT_SIZE = 1 << 18
+
+# A top-level closing brace followed by a new line that starts with something that
+# cannot continue the expression (no operator, else, accessor or body) ends it for sure
+SEGMENT_START_TYPES = tuple(ttype.value for ttype in (
+    TokenType.NAME, TokenType.INT, TokenType.FLOAT, TokenType.STRING, TokenType.TRUE, TokenType.FALSE,
+    TokenType.NULL, TokenType.IF, TokenType.FOR, TokenType.FN, TokenType.MATCH, TokenType.CLASS,
+    TokenType.STATIC, TokenType.TRAIT, TokenType.RETURN, TokenType.BREAK, TokenType.CONTINUE,
+    TokenType.LEAVE, TokenType.DEFER, TokenType.YIELD))
+
+# Segment boundaries are found without lexing: only strings and comments (which can hide brackets),
+# brackets and the first word or literal of each line are matched, everything else is skipped over
+SEGMENT_SCAN_PATTERN = r"""
+    "(?:[^"\\]|\\.)*" | '(?:[^'\\]|\\.)*' | \#[^\n]*
+  | (?P<open>[(\[{]) | (?P<close>[)\]}])
+  | \n[ \t]*(?=(?P<start>[A-Za-z_][A-Za-z0-9_]*|[0-9"']))
+"""
+SEGMENT_SCAN_REGEX = re.compile(SEGMENT_SCAN_PATTERN, re.VERBOSE | re.DOTALL)
+SEGMENT_SCAN_REGEX_BYTES = re.compile(SEGMENT_SCAN_PATTERN.encode(), re.VERBOSE | re.DOTALL)
+
+_compiler_version = None
+
+def compiler_version():
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256("{}.{}".format(*sys.version_info[:2]).encode())
+        for module in ("lex", "parser", "astree"):
+            with open(sys.modules[module].__file__, "rb") as module_file:
+                digest.update(module_file.read())
+        _compiler_version = digest.digest()[:16]
+    return _compiler_version
+
+def cache_path(script_path):
+    script_path = os.path.abspath(script_path)
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if cache_dir:
+        name = hashlib.sha256(script_path.encode()).hexdigest()[:32]
+    else:
+        cache_dir = os.path.join(os.path.dirname(script_path), CACHE_DIR_NAME)
+        name = os.path.basename(script_path)
+    return os.path.join(cache_dir, name + "c")
+
+def source_hash(source):
+    return hashlib.sha256(source).digest()
+
+def header(source):
+    return CACHE_MAGIC + compiler_version() + source_hash(source)
+
+# Trees are stored as a flat arena rather than pickled, so a cache file can only ever decode
+# to AST nodes and never runs code
+def dumps(ast):
+    return zlib.compress(Arena.from_ast(ast).to_bytes())
+
+def loads(data):
+    return Arena.from_bytes(zlib.decompress(data)).node()
+
+def private(path):
+    # Anyone who can write the cache decides which tree a script runs
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return False
+    return not mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def read(script_path, source):
+    path = cache_path(script_path)
+    if not private(os.path.dirname(path)) or not private(path):
+        return None
+    try:
+        with open(path, "rb") as cache_file:
+            data = cache_file.read()
+    except OSError:
+        return None
+    expected = header(source)
+    if not data.startswith(expected):
+        return None
+    return data[len(expected):]
+
+def load(script_path, source):
+    data = read(script_path, source)
+    if data is None:
+        return None
+    try:
+        return loads(data)
+    except (zlib.error, struct.error, ValueError, TypeError, KeyError, IndexError, RecursionError):
+        return None
+
+def store(script_path, source, ast, data=None):
+    path = cache_path(script_path)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        if data is None:
+            data = dumps(ast)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not private(os.path.dirname(path)):
+            return
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(header(source))
+            cache_file.write(data)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError, RecursionError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def split_segments(source, segment_size=SEGMENT_SIZE):
+    if is_binary(source):
+        finditer = SEGMENT_SCAN_REGEX_BYTES.finditer
+        reserved_words = RESERVED_WORDS_BYTES
+        close_brace, newline, comment = b"}", b"\n", b"#"
+    else:
+        finditer = SEGMENT_SCAN_REGEX.finditer
+        reserved_words = RESERVED_WORDS
+        close_brace, newline, comment = "}", "\n", "#"
+    bounds = []
+    start = 0
+    depth = 0
+    brace_end = -1
+    for m in finditer(source):
+        if m.group("open") is not None:
+            depth += 1
+        elif m.group("close") is not None:
+            depth -= 1
+            if m.group("close") == close_brace:
+                brace_end = m.end()
+                continue
+        elif m.group("start") is not None:
+            pos = m.end()
+            ttype = reserved_words.get(m.group("start"))
+            if (depth == 0 and brace_end >= 0 and pos - start >= segment_size
+                    and (ttype is None or ttype.value in SEGMENT_START_TYPES)
+                    and all(not line.strip() or line.lstrip().startswith(comment)
+                            for line in source[brace_end:m.start()].split(newline))):
+                bounds.append((start, pos))
+                start = pos
+        elif m.group().startswith(comment):
+            continue
+        brace_end = -1
+    bounds.append((start, len(source)))
+    return bounds
+
+def parse_segment(segment):
+    parser = Parser(segment)
+    parser.lexer.lex()
+    return list(parser.top_exprs())
+
+def intern_names(node, names, seen):
+    if isinstance(node, list):
+        for item in node:
+            intern_names(item, names, seen)
+    elif isinstance(node, dict):
+        for item in node.values():
+            intern_names(item, names, seen)
+    elif isinstance(node, ASTNode) and id(node) not in seen:
+        seen.add(id(node))
+        if isinstance(node, Name):
+            node.name = names.name(names.intern(node.name))
+        elif dataclasses.is_dataclass(node):
+            for node_field in dataclasses.fields(node):
+                intern_names(getattr(node, node_field.name), names, seen)
+
+def parse_source(source, workers=None, segment_size=SEGMENT_SIZE):
+    bounds = split_segments(source, segment_size) if len(source) >= 2 * segment_size else [(0, len(source))]
+    if len(bounds) > 1 and workers != 1:
+        try:
+            with ProcessPoolExecutor(workers) as pool:
+                segments = pool.map(parse_segment, [source[start:end] for start, end in bounds])
+                exprs = [expr for segment in segments for expr in segment]
+                # Each worker interned into its own table, share one string per name again
+                intern_names(exprs, NameTable(), set())
+                return ExprList(exprs)
+        except (BrokenProcessPool, PicklingError):
+            pass
+    return ExprList(parse_segment(source))
+
+def parse_file(script_path, use_cache=True, workers=1):
+    with mapped_source(script_path) as source:
+        if use_cache:
+            ast = load(script_path, source)
+            if ast is not None:
+                return ast
+        if workers == 1:
+            ast = ExprList(parse_segment(source))
+        else:
+            ast = parse_source(source, workers)
+        if use_cache:
+            store(script_path, source, ast)
+        return ast
+
+def compile_file(script_path, use_cache=True):
+    try:
+        with mapped_source(script_path) as source:
+            data = read(script_path, source) if use_cache else None
+            if data is None:
+                ast = parse_source(source, workers=1)
+                data = dumps(ast)
+                if use_cache:
+                    store(script_path, source, ast, data)
+        return script_path, data, None
+    except Exception as e:
+        return script_path, None, e
+
+def script_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            yield from sorted(glob.glob(os.path.join(path, "**", "*.ff"), recursive=True))
+        else:
+            yield path
+
+def compile_batch(paths, workers=None, use_cache=True):
+    paths = list(script_paths(paths))
+    if len(paths) == 1:
+        script_path = paths[0]
+        try:
+            ast = parse_file(script_path, use_cache, workers)
+            return [(script_path, dumps(ast), None)]
+        except Exception as e:
+            return [(script_path, None, e)]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(compile_file, paths, [use_cache] * len(paths)))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    workers = None
+    if args[:1] == ["-j"]:
+        workers = int(args[1])
+        args = args[2:]
+    failed = False
+    for script_path, data, error in compile_batch(args, workers):
+        if error is None:
+            print(cache_path(script_path))
+        else:
+            print("{}: {}".format(script_path, error), file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+
+import sys
+from astree import BinOp, Name
+from runtime import FSFunc, FSObject, Environment, UNBOUND, LOOP, literal_literal
+from runtime import BINARY_FUNCS, UNARY_FUNCS, box, unbox, value_of
+from resolver import Resolver, DYNAMIC
+
+def call_function(func, args, environment):
+    if not isinstance(func, FSFunc):
+        return func(*[box(environment, arg) for arg in args])
+    call_env = func.enter(args, environment)
+    if func.code is None:
+        func.code = ClosureCompiler().compile_function(func.body, func.scope)
+    return func.code(call_env)
+
+class ClosureCompiler:
+    def compile(self, node):
+        return node.visit(self)
+
+    def compile_function(self, body, scope):
+        if scope is not None and not scope.resolved:
+            Resolver().resolve_function(scope, body)
+        return self.compile(body)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def unsupported(node, **kwargs):
+            return self.error("{} is not supported yet".format(type(node).__name__))
+        return unsupported
+
+    def error(self, message):
+        def run(*args):
+            raise Exception(message)
+        return run
+
+    def constant(self, value, literal_type):
+        boxed = None
+        def run(env):
+            nonlocal boxed
+            if boxed is None:
+                boxed = literal_literal(env, value, literal_type)
+            return boxed
+        return run
+
+    def stringlit(self, string_ele):
+        return self.constant(string_ele.value, "str")
+
+    def native(self, value):
+        def run(env):
+            return value
+        return run
+
+    def intlit(self, int_ele):
+        return self.native(int_ele.value)
+
+    def floatlit(self, float_ele):
+        return self.native(float_ele.value)
+
+    def arraylit(self, array_ele):
+        items = [self.compile(x) for x in array_ele.value]
+        def run(env):
+            return literal_literal(env, [box(env, item(env)) for item in items], "array")
+        return run
+
+    def dictlit(self, dict_ele):
+        items = [(k, self.compile(v)) for k, v in dict_ele.value.items()]
+        def run(env):
+            return literal_literal(env, {k: box(env, v(env)) for k, v in items}, "dict")
+        return run
+
+    def boollit(self, bool_ele):
+        return self.native(bool_ele.value)
+
+    def nulllit(self, null_ele):
+        def run(env):
+            return env.get("null")
+        return run
+
+    def name(self, name_ele):
+        name = name_ele.name
+        address = name_ele.address or DYNAMIC
+        candidates, boundary = address
+        if len(candidates) == 1 and candidates[0][0] == 0:
+            slot = candidates[0][1]
+            def run(env):
+                value = env.slots[slot]
+                if value is UNBOUND:
+                    return env.lookup(name, address)
+                return value
+            return run
+        def run(env):
+            return env.lookup(name, address)
+        return run
+
+    def primary(self, primary_ele):
+        target = self.compile(primary_ele.target)
+        accessors = []
+        accessor = primary_ele.accessor
+        while accessor is not None:
+            accessors.append(self.compile(accessor.access_type))
+            accessor = accessor.next_accessor
+        if not accessors:
+            return target
+        def run(env):
+            value = target(env)
+            for access in accessors:
+                value = access(value, env)
+            return value
+        return run
+
+    def call(self, call_ele):
+        args = [self.compile(arg) for arg in call_ele.args]
+        def run(func, env):
+            return call_function(func, [arg(env) for arg in args], env)
+        return run
+
+    def exprlist(self, exprlist_ele):
+        exprs = [self.compile(expr) for expr in exprlist_ele.exprs]
+        if len(exprs) == 1:
+            return exprs[0]
+        def run(env):
+            last_ret = None
+            for expr in exprs:
+                last_ret = expr(env)
+                if env.break_called:
+                    break
+            return last_ret
+        return run
+
+    def assign(self, assign_ele):
+        expr = self.compile(assign_ele.expr)
+        target = assign_ele.target
+        if target.accessor is not None:
+            get = self.compile(target)
+            def run(env):
+                expr(env)
+                return get(env)
+            return run
+        if not isinstance(target.target, Name):
+            return self.error("Cannot assign to {}".format(target.target.lprint()))
+        name = target.target.name
+        address = target.target.address or DYNAMIC
+        def run(env):
+            return env.store(name, expr(env), address)
+        return run
+
+    def binexpr(self, binexpr_ele):
+        operator = binexpr_ele.operator
+        lhs = self.compile(binexpr_ele.lhs)
+        rhs = self.compile(binexpr_ele.rhs)
+        if operator == BinOp.AND:
+            def run(env):
+                res = value_of(lhs(env))
+                if res is True:
+                    res = value_of(rhs(env))
+                return res
+        elif operator == BinOp.OR:
+            def run(env):
+                res = value_of(lhs(env))
+                if res is False:
+                    res = value_of(rhs(env))
+                return res
+        elif operator in BINARY_FUNCS:
+            func = BINARY_FUNCS[operator]
+            def run(env):
+                a = lhs(env)
+                if a.__class__ is FSObject:
+                    a = a.fields["value"]
+                b = rhs(env)
+                if b.__class__ is FSObject:
+                    b = b.fields["value"]
+                return func(a, b)
+        else:
+            return self.error("Unimplemented operator")
+        return run
+
+    def unexpr(self, unexpr_ele):
+        if unexpr_ele.operator not in UNARY_FUNCS:
+            return self.error("unimplemented")
+        func = UNARY_FUNCS[unexpr_ele.operator]
+        rhs = self.compile(unexpr_ele.rhs)
+        def run(env):
+            value = rhs(env)
+            if value.__class__ is FSObject:
+                value = value.fields["value"]
+            return func(value)
+        return run
+
+    def ifexpr(self, ifexpr_ele):
+        guard = self.compile(ifexpr_ele.guard)
+        expr = self.compile(ifexpr_ele.expr)
+        elexpr = None if ifexpr_ele.elexpr is None else self.compile(ifexpr_ele.elexpr)
+        def run(env):
+            if guard(env) is True:
+                return expr(env)
+            if elexpr is not None:
+                return elexpr(env)
+        return run
+
+    def elseexpr(self, elseexpr_ele):
+        return self.compile(elseexpr_ele.expr)
+
+    def forexpr(self, forexpr_ele):
+        iter_expr = self.compile(forexpr_ele.iter_expr)
+        iter_name = forexpr_ele.iter_name.name
+        expr = self.compile(forexpr_ele.expr)
+        elexpr = None if forexpr_ele.elexpr is None else self.compile(forexpr_ele.elexpr)
+        scope = forexpr_ele.scope
+        def run(env):
+            iter_arr = iter_expr(env).fields["value"]
+            last_expr = env.get("null")
+            loop_env = env.descend(scope, LOOP)
+            loop_ran = False
+            for iter_val in iter_arr:
+                if loop_env.break_called:
+                    break
+                loop_ran = True
+                loop_env.bind(iter_name, unbox(iter_val))
+                last_expr = expr(loop_env)
+            if not loop_ran and elexpr is not None:
+                return elexpr(env)
+            return last_expr
+        return run
+
+    def whileexpr(self, whileexpr_ele):
+        guard = self.compile(whileexpr_ele.guard)
+        expr = self.compile(whileexpr_ele.expr)
+        elexpr = None if whileexpr_ele.elexpr is None else self.compile(whileexpr_ele.elexpr)
+        scope = whileexpr_ele.scope
+        def run(env):
+            last_expr = env.get("null")
+            loop_ran = False
+            loop_env = env.descend(scope, LOOP, "while")
+            while guard(loop_env) is True and not loop_env.break_called:
+                loop_ran = True
+                last_expr = expr(loop_env)
+            if not loop_ran and elexpr is not None:
+                return elexpr(env)
+            return last_expr
+        return run
+
+    def dowhileexpr(self, dowhileexpr_ele):
+        guard = self.compile(dowhileexpr_ele.guard)
+        expr = self.compile(dowhileexpr_ele.expr)
+        scope = dowhileexpr_ele.scope
+        def run(env):
+            loop_env = env.descend(scope, LOOP)
+            last_expr = expr(loop_env)
+            while guard(loop_env) is True and not loop_env.break_called:
+                last_expr = expr(loop_env)
+            return last_expr
+        return run
+
+    def block(self, block_ele):
+        label = None if block_ele.label is None else self.compile(block_ele.label)
+        exprs = self.compile(block_ele.exprs)
+        scope = block_ele.scope
+        def run(env):
+            block_env = env.descend(scope, label="block" if label is None else label(env))
+            ret_expr = exprs(block_env)
+            if block_env.defer_exprs:
+                for defer_expr in block_env.defer_exprs:
+                    ret_expr = defer_expr(block_env)
+            return ret_expr
+        return run
+
+    def deferexpr(self, defer_ele):
+        expr = self.compile(defer_ele.expr)
+        def run(env):
+            env.add_defer(expr)
+        return run
+
+    def returnexpr(self, return_ele):
+        expr = None if return_ele.expr is None else self.compile(return_ele.expr)
+        def run(env):
+            env.do_return()
+            if expr is not None:
+                return expr(env)
+        return run
+
+    def breakexpr(self, break_ele):
+        expr = None if break_ele.expr is None else self.compile(break_ele.expr)
+        def run(env):
+            env.do_break()
+            if expr is not None:
+                return expr(env)
+        return run
+
+    def fndecl(self, fndecl_ele):
+        name = None if fndecl_ele.name is None else fndecl_ele.name.name
+        args = [x.target.name for x in fndecl_ele.args]
+        body = fndecl_ele.expr
+        closed_symbols = body.grab_primaries()
+        scope = fndecl_ele.scope
+        address = None if name is None else fndecl_ele.name.address or DYNAMIC
+        code = None
+        def run(env):
+            nonlocal code
+            if code is None:
+                code = self.compile_function(body, scope)
+            closure = Environment()
+            for symbol in closed_symbols:
+                value = env.get(symbol, can_fail=True)
+                if value is not None:
+                    closure.symbols[symbol] = value
+            if name is not None:
+                env.store(name, FSFunc(args, body, code=code, scope=scope), address)
+            return FSFunc(args, body, closure, code, scope)
+        return run
+
+    def classdecl(self, classdecl_ele):
+        name = None if classdecl_ele.name is None else classdecl_ele.name.name
+        def run(env):
+            print("classdecl", name)
+            raise Exception("not done yet")
+        return run
+
+if __name__ == "__main__":
+    from interp import Interpreter
+    interp = Interpreter("closure")
+    interp.interpret(interp.parse_file(sys.argv[1]))
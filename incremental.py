@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import sys
+from array import array
+from bisect import bisect_right
+from lex import NameTable, TokenType
+from parser import Parser
+from astree import ExprList
+
+class Document:
+    def __init__(self, source=""):
+        self.source = ""
+        self.names = NameTable()
+        self.starts = array("i")
+        self.exprs = []
+        self.edit(0, 0, source)
+
+    def ast(self):
+        return ExprList(list(self.exprs))
+
+    def line_offset(self, line, col=1):
+        offset = 0
+        for i in range(line - 1):
+            offset = self.source.index("\n", offset) + 1
+        return offset + col - 1
+
+    def edit(self, start, end, text):
+        if start < 0 or end < start or end > len(self.source):
+            raise Exception("Edit range {}:{} is outside the document".format(start, end))
+        source = self.source[:start] + text + self.source[end:]
+        delta = len(text) - (end - start)
+        edit_end = start + len(text)
+        # The segment before the edit is reparsed too, since its end was decided by lookahead into ours
+        first = max(bisect_right(self.starts, start) - 2, 0)
+        pos = self.starts[first] if first < len(self.starts) else 0
+        parser = Parser(source, stream=True, names=self.names, offset=pos)
+        lexer = parser.lexer
+        lexer.lex()
+        starts = self.starts[:first]
+        exprs = self.exprs[:first]
+        old = first
+        while lexer.peek_type() != TokenType.EOF:
+            if pos >= edit_end:
+                while old < len(self.starts) and self.starts[old] + delta < pos:
+                    old += 1
+                if old < len(self.starts) and self.starts[old] + delta == pos:
+                    break
+            starts.append(pos)
+            exprs.append(parser.expr())
+            pos = lexer.peek_offset()
+        else:
+            old = len(self.starts)
+        stop = len(exprs)
+        replaced = self.exprs[first:old]
+        if delta:
+            starts.extend(array("i", [offset + delta for offset in self.starts[old:]]))
+        else:
+            starts.extend(self.starts[old:])
+        exprs.extend(self.exprs[old:])
+        self.source = source
+        self.starts = starts
+        self.exprs = exprs
+        changed = []
+        for i in range(first, stop):
+            if i - first >= len(replaced) or exprs[i] != replaced[i - first]:
+                changed.append(exprs[i])
+        return changed
+
+    def append(self, text):
+        return self.edit(len(self.source), len(self.source), text)
+
+    def replace_lines(self, first_line, last_line, text):
+        start = self.line_offset(first_line)
+        end = self.source.find("\n", self.line_offset(last_line))
+        end = len(self.source) if end == -1 else end + 1
+        return self.edit(start, end, text)
+
+if __name__ == "__main__":
+    with open(sys.argv[1]) as source_file:
+        document = Document(source_file.read())
+    print(document.ast().lprint())
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
 import sys
+import mmap
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum, auto
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import string
+import re
+from array import array
+from bisect import bisect_right
 
 class TokenType(Enum):
     NEWLINE = auto()
@@ -104,6 +110,7 @@ class Token:
     lexeme: str
     col: int
     line: int
+    symbol: int = field(default=-1, repr=False, compare=False)
 
     def is_op(self, *ttypes):
         for ttype in ttypes:
@@ -141,6 +148,228 @@ class Token:
     def is_factorop(self):
         return self.is_op(TokenType.MINUS, TokenType.TILDE, TokenType.PLUS)
 
+TERMINATOR_TYPES = (TokenType.NEWLINE, TokenType.SEMICOLON)
+TERMINATOR_VALUES = tuple(ttype.value for ttype in TERMINATOR_TYPES)
+
+TTYPES = [None] * (max(ttype.value for ttype in TokenType) + 1)
+for ttype in TokenType:
+    TTYPES[ttype.value] = ttype
+
+def is_binary(source):
+    return not isinstance(source, str)
+
+def map_source(path):
+    with open(path, "rb") as source_file:
+        try:
+            return mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return b""
+
+@contextmanager
+def mapped_source(path):
+    source = map_source(path)
+    try:
+        yield source
+    finally:
+        if isinstance(source, mmap.mmap):
+            source.close()
+
+class NameTable:
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, key):
+        symbol = self.ids.get(key)
+        if symbol is None:
+            name = key if isinstance(key, str) else key.decode("utf-8")
+            symbol = self.ids.get(name)
+            if symbol is None:
+                symbol = len(self.names)
+                self.ids[name] = symbol
+                self.names.append(sys.intern(name))
+            self.ids[key] = symbol
+        return symbol
+
+    def name(self, symbol):
+        return self.names[symbol]
+
+    def __len__(self):
+        return len(self.names)
+
+class LineIndex:
+    def __init__(self, source):
+        self.source = source
+        self.first_line = 1
+        self.line_starts = array("i", [0])
+        self.scanned = 0
+
+    def anchor(self, offset):
+        newline_char = b"\n" if is_binary(self.source) else "\n"
+        line_start = self.source.rfind(newline_char, 0, offset) + 1
+        # mmap has find but no count
+        find = self.source.find
+        self.first_line = 1
+        newline = find(newline_char, 0, line_start)
+        while newline != -1:
+            self.first_line += 1
+            newline = find(newline_char, newline + 1, line_start)
+        self.line_starts = array("i", [line_start])
+        self.scanned = line_start
+
+    def build(self, offset=None):
+        if offset is None:
+            offset = len(self.source)
+        find = self.source.find
+        newline_char = b"\n" if is_binary(self.source) else "\n"
+        while self.scanned <= offset:
+            newline = find(newline_char, self.scanned)
+            if newline == -1:
+                self.scanned = len(self.source) + 1
+                break
+            self.line_starts.append(newline + 1)
+            self.scanned = newline + 1
+
+    def position(self, offset):
+        self.build(offset)
+        line = bisect_right(self.line_starts, offset)
+        return self.first_line + line - 1, offset - self.line_starts[line - 1] + 1
+
+class TokenBuffer:
+    def __init__(self, source="", names=None):
+        self.source = source
+        self.binary = is_binary(source)
+        self.names = NameTable() if names is None else names
+        self.line_index = LineIndex(source)
+        self.base = 0
+        self.ttypes = array("i")
+        self.starts = array("i")
+        self.ends = array("i")
+        self.symbols = array("i")
+        self.significant_index = None
+        self.cached_pos = -1
+        self.cached_token = None
+
+    def append(self, ttype, start, end, symbol=-1):
+        self.ttypes.append(ttype.value)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.symbols.append(symbol)
+
+    def __len__(self):
+        return len(self.ttypes)
+
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += self.end()
+        if pos != self.cached_pos:
+            line, col = self.position(pos)
+            self.cached_token = Token(self.ttype(pos), self.lexeme(pos), col, line, self.symbols[pos - self.base])
+            self.cached_pos = pos
+        return self.cached_token
+
+    def __iter__(self):
+        for pos in range(self.base, self.end()):
+            yield self[pos]
+
+    def end(self):
+        return self.base + len(self.ttypes)
+
+    def clamp(self, pos):
+        return min(pos, self.end() - 1)
+
+    def discard(self, pos):
+        pass
+
+    def index_significant(self):
+        ttypes = self.ttypes
+        index = array("i", bytes(ttypes.itemsize * len(ttypes)))
+        next_pos = self.end() - 1
+        for i in range(len(ttypes) - 1, -1, -1):
+            if ttypes[i] not in TERMINATOR_VALUES:
+                next_pos = self.base + i
+            index[i] = next_pos
+        self.significant_index = index
+
+    def significant(self, pos):
+        if self.significant_index is None:
+            self.index_significant()
+        return self.significant_index[pos - self.base]
+
+    def ttype(self, pos):
+        return TTYPES[self.ttypes[pos - self.base]]
+
+    def lexeme(self, pos):
+        symbol = self.symbols[pos - self.base]
+        if symbol != -1:
+            return self.names.name(symbol)
+        start = self.starts[pos - self.base]
+        end = self.ends[pos - self.base]
+        if self.ttypes[pos - self.base] == TokenType.STRING.value:
+            start += 1
+            end -= 1
+        if self.binary:
+            return self.source[start:end].decode("utf-8")
+        return self.source[start:end]
+
+    def offset(self, pos):
+        return self.starts[pos - self.base]
+
+    def position(self, pos):
+        return self.line_index.position(self.starts[pos - self.base])
+
+class TokenStream(TokenBuffer):
+    DISCARD_CHUNK = 256
+
+    def __init__(self, source, tokens, names=None):
+        super().__init__(source, names)
+        self.tokens = tokens
+        self.done = False
+
+    def fill(self, pos):
+        while not self.done and pos >= self.end():
+            token = next(self.tokens, None)
+            if token is None:
+                self.done = True
+            else:
+                self.append(*token)
+
+    def __getitem__(self, pos):
+        self.fill(pos)
+        return super().__getitem__(pos)
+
+    def __iter__(self):
+        pos = self.base
+        while True:
+            self.fill(pos)
+            if pos >= self.end():
+                return
+            yield self[pos]
+            pos += 1
+
+    def clamp(self, pos):
+        self.fill(pos)
+        return min(pos, self.end() - 1)
+
+    def index_significant(self):
+        pass
+
+    def significant(self, pos):
+        while self.ttype(pos) in TERMINATOR_TYPES:
+            pos += 1
+        return pos
+
+    def discard(self, pos):
+        drop = pos - self.base
+        if drop < self.DISCARD_CHUNK:
+            return
+        for column in (self.ttypes, self.starts, self.ends, self.symbols):
+            del column[:drop]
+        self.base = pos
+
+    def ttype(self, pos):
+        self.fill(pos)
+        return super().ttype(pos)
 
 RESERVED_WORDS = {
     "and": TokenType.AND,
@@ -183,50 +412,130 @@ RESERVED_WORDS = {
     "_": TokenType.UNDERSCORE
 }
 
+OPERATORS = {
+    ";": TokenType.SEMICOLON,
+    ":": TokenType.COLON,
+    ".": TokenType.DOT,
+    ",": TokenType.COMMA,
+    "(": TokenType.OPEN_PAREN,
+    ")": TokenType.CLOSE_PAREN,
+    "{": TokenType.OPEN_BRACE,
+    "}": TokenType.CLOSE_BRACE,
+    "[": TokenType.OPEN_SQUARE,
+    "]": TokenType.CLOSE_SQUARE,
+    "+": TokenType.PLUS,
+    "-": TokenType.MINUS,
+    "~": TokenType.TILDE,
+    "%": TokenType.PERCENT,
+    "^": TokenType.CARET,
+    "=": TokenType.EQUAL,
+    "==": TokenType.EQUALEQUAL,
+    "*": TokenType.STAR,
+    "**": TokenType.STARSTAR,
+    "/": TokenType.SLASH,
+    "//": TokenType.SLASHSLASH,
+    "&": TokenType.AMP,
+    "&&": TokenType.AMPAMP,
+    "!": TokenType.BANG,
+    "!=": TokenType.BANGEQUAL,
+    "|": TokenType.PIPE,
+    "||": TokenType.PIPEPIPE,
+    "<": TokenType.LT,
+    "<=": TokenType.LE,
+    "<<": TokenType.LSHIFT,
+    ">": TokenType.GT,
+    ">=": TokenType.GE,
+    ">>": TokenType.RSHIFT,
+}
+
+TOKEN_PATTERN = r"""
+    (?P<SKIP>[ \t]+|\#[^\n]*)
+  | (?P<NEWLINE>\n)
+  | (?P<INT>0[xX][0-9a-fA-F_]*|0[oO][0-7_]*|0[bB][01_]*)
+  | (?P<FLOAT>[0-9][0-9_]*\.[0-9][0-9_]*)
+  | (?P<DEC>[0-9][0-9_]*)
+  | (?P<STRING>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<NAME>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<OP>{})
+  | (?P<ERROR>.)
+""".format("|".join(re.escape(op) for op in sorted(OPERATORS, key=len, reverse=True)))
+
+TOKEN_REGEX = re.compile(TOKEN_PATTERN, re.VERBOSE | re.DOTALL)
+TOKEN_REGEX_BYTES = re.compile(TOKEN_PATTERN.encode(), re.VERBOSE | re.DOTALL)
+RESERVED_WORDS_BYTES = {word.encode(): ttype for word, ttype in RESERVED_WORDS.items()}
+OPERATORS_BYTES = {op.encode(): ttype for op, ttype in OPERATORS.items()}
+
+SCAN_TOKEN_TYPES = {
+    "NEWLINE": TokenType.NEWLINE,
+    "INT": TokenType.INT,
+    "DEC": TokenType.INT,
+    "FLOAT": TokenType.FLOAT,
+    "STRING": TokenType.STRING,
+}
+
+LEX_ENGINES = ("regex", "classic", "parallel")
+
+PARALLEL_CHUNK_SIZE = 1 << 20
+
+def scan_chunk(chunk, offset):
+    lexer = Lexer(chunk)
+    tokens = lexer.token_list
+    error_pos = -1
+    try:
+        for token in lexer.scan_regex():
+            tokens.append(*token)
+        for column in (tokens.ttypes, tokens.starts, tokens.ends, tokens.symbols):
+            column.pop()
+    except Exception:
+        error_pos = offset + (tokens.ends[-1] if len(tokens) > 0 else 0)
+    starts = array("i", (start + offset for start in tokens.starts))
+    ends = array("i", (end + offset for end in tokens.ends))
+    return tokens.ttypes, starts, ends, tokens.symbols, lexer.names.names, error_pos
+
 class Lexer:
-    def __init__(self, source):
-        self.reset()
+    def __init__(self, source, engine="regex", stream=False, names=None, offset=0):
+        if engine not in LEX_ENGINES:
+            raise Exception("Unknown lexer engine " + engine)
+        if stream and engine != "regex":
+            raise Exception("Streaming needs the regex engine")
+        if is_binary(source) and engine == "classic":
+            raise Exception("Binary sources need the regex or parallel engine")
+        self.stream = stream
+        self.names = NameTable() if names is None else names
+        self.reset(source, offset)
         self.cur_token_pos = 0
+        self.engine = engine
+
+    def reset(self, source="", offset=0):
+        self.start = offset
+        self.cur = offset
         self.text = source
-        self.backtrack_stack = []
-
-    def reset(self):
-        self.start = 0
-        self.start_col = 1
-        self.start_line = 1
-        self.cur = 0
-        self.col = 1
-        self.line = 1
-        self.text = ""
-        self.token_list = []
+        if self.stream:
+            self.token_list = TokenStream(source, self.scan_regex(), self.names)
+        else:
+            self.token_list = TokenBuffer(source, self.names)
+        if offset:
+            self.token_list.line_index.anchor(offset)
 
     def new_lexeme(self):
         self.start = self.cur
-        self.start_col = self.col
-        self.start_line = self.line
 
     def get_lexeme(self):
         return self.text[self.start:self.cur]
 
     def add_token(self, token_type):
-        lexeme = self.get_lexeme()
-        if token_type == TokenType.STRING:
-            lexeme = lexeme[1:-1]
-        self.token_list.append(Token(token_type, lexeme, self.start_col, self.start_line))
+        symbol = -1
+        if token_type == TokenType.NAME:
+            symbol = self.names.intern(self.get_lexeme())
+        self.token_list.append(token_type, self.start, self.cur, symbol)
         self.new_lexeme()
 
     def advance(self, length=1):
-        for i in range(length):
-            ret_c = self.text[self.cur]
-            self.col += 1
-            if ret_c == '\n':
-                self.col = 1
-                self.line += 1
-            self.cur += 1
-        return ret_c
+        self.cur += length
+        return self.text[self.cur - 1]
 
     def match(self, match_func, eat=True):
-        if self.cur + 1 >= len(self.text):
+        if self.cur >= len(self.text):
             return False
         elif match_func(self.text[self.cur]) is False:
             return False
@@ -249,6 +558,106 @@ class Lexer:
         return self.cur >= len(self.text) - 1
 
     def lex(self):
+        if self.stream:
+            self.cur_token_pos = 0
+            return self.token_list
+        elif self.engine == "classic":
+            self.lex_classic()
+        elif self.engine == "parallel":
+            self.lex_parallel()
+        else:
+            self.lex_regex()
+        self.token_list.index_significant()
+        return self.token_list
+
+    def lex_regex(self):
+        append = self.token_list.append
+        for token in self.scan_regex():
+            append(*token)
+        self.cur_token_pos = 0
+        return self.token_list
+
+    def lex_parallel(self, workers=None, chunk_size=PARALLEL_CHUNK_SIZE):
+        text = self.text
+        newline = b"\n" if is_binary(text) else "\n"
+        bounds = [0]
+        while bounds[-1] < len(text):
+            split = text.find(newline, bounds[-1] + chunk_size)
+            bounds.append(len(text) if split == -1 else split + 1)
+        if len(bounds) <= 2:
+            return self.lex_regex()
+        token_list = self.token_list
+        boundary_set = set(bounds)
+        pos = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = pool.map(scan_chunk, (text[bounds[i]:bounds[i+1]] for i in range(len(bounds) - 1)), bounds[:-1])
+            for i, (ttypes, starts, ends, symbols, names, error_pos) in enumerate(chunks):
+                if bounds[i] != pos:
+                    continue
+                remap = [self.names.intern(name) for name in names]
+                token_list.ttypes.extend(ttypes)
+                token_list.starts.extend(starts)
+                token_list.ends.extend(ends)
+                token_list.symbols.extend(array("i", (-1 if symbol == -1 else remap[symbol] for symbol in symbols)))
+                if error_pos == -1:
+                    pos = bounds[i+1]
+                else:
+                    pos = self.rescan(error_pos, boundary_set)
+        self.cur = len(text)
+        self.new_lexeme()
+        self.add_token(TokenType.EOF)
+        self.cur_token_pos = 0
+        return self.token_list
+
+    def rescan(self, pos, boundary_set):
+        self.cur = pos
+        append = self.token_list.append
+        for token in self.scan_regex():
+            if token[0] == TokenType.EOF:
+                break
+            append(*token)
+            if token[0] == TokenType.NEWLINE and token[2] in boundary_set:
+                return token[2]
+        return len(self.text)
+
+    def scan_regex(self):
+        text = self.text
+        pos = self.cur
+        end = len(text)
+        intern = self.names.intern
+        if is_binary(text):
+            match = TOKEN_REGEX_BYTES.match
+            reserved_words = RESERVED_WORDS_BYTES
+            operators = OPERATORS_BYTES
+        else:
+            match = TOKEN_REGEX.match
+            reserved_words = RESERVED_WORDS
+            operators = OPERATORS
+        while pos < end:
+            m = match(text, pos)
+            kind = m.lastgroup
+            start = pos
+            pos = m.end()
+            if kind == "SKIP":
+                continue
+            elif kind == "NAME":
+                lexeme = m.group()
+                ttype = reserved_words.get(lexeme)
+                if ttype is None:
+                    yield (TokenType.NAME, start, pos, intern(lexeme))
+                    continue
+            elif kind == "OP":
+                ttype = operators[m.group()]
+            elif kind in SCAN_TOKEN_TYPES:
+                ttype = SCAN_TOKEN_TYPES[kind]
+            else:
+                raise Exception("Unhandled char {}".format(m.group()))
+            yield (ttype, start, pos)
+        self.cur = pos
+        self.new_lexeme()
+        yield (TokenType.EOF, pos, pos)
+
+    def lex_classic(self):
         while self.cur < len(self.text):
             char = self.advance()
             if char in [' ', '\t']:
@@ -313,7 +722,7 @@ class Lexer:
                 if self.match_char("="):
                     self.add_token(TokenType.BANGEQUAL)
                 else:
-                    self.add_token(TokenType.EQUAL)
+                    self.add_token(TokenType.BANG)
             elif char == "|":
                 if self.match_char("|"):
                     self.add_token(TokenType.PIPEPIPE)
@@ -387,14 +796,24 @@ class Lexer:
 
     def next_token(self, num=1):
         ret_token = self.peek(num-1)
-        self.cur_token_pos = min(self.cur_token_pos + num, len(self.token_list) - 1)
+        self.cur_token_pos = self.token_list.clamp(self.cur_token_pos + num)
+        self.token_list.discard(self.cur_token_pos - 1)
         return ret_token
 
     def peek(self, num=0):
-        return self.token_list[min(self.cur_token_pos + num, len(self.token_list) - 1)]
+        return self.token_list[self.token_list.clamp(self.cur_token_pos + num)]
+
+    def peek_type(self, num=0):
+        return self.token_list.ttype(self.token_list.clamp(self.cur_token_pos + num))
+
+    def peek_offset(self, num=0):
+        return self.token_list.offset(self.token_list.clamp(self.cur_token_pos + num))
+
+    def peek_significant(self, num=0):
+        return self.token_list.significant(self.token_list.clamp(self.cur_token_pos + num)) - self.cur_token_pos
 
     def print_current(self):
-        print("<{}>, {}".format(self.peek(), [str(self.token_list[x]) for x in range(self.cur_token_pos+1, len(self.token_list))]))
+        print("<{}>, {}".format(self.peek(), [str(self.token_list[x]) for x in range(self.cur_token_pos+1, self.token_list.end())]))
 
     def token_check(self, *ttypes):
         for ttype in ttypes:
@@ -402,17 +821,17 @@ class Lexer:
                 return True
         return False
 
-    def mark_backtrack(self):
-        self.backtrack_stack.append(self.cur_token_pos)
-
-    def backtrack(self):
-        self.cur_token_pos = self.backtrack_stack.pop()
+    def seek(self, pos):
+        self.cur_token_pos = pos
 
 if __name__ == "__main__":
     token_list = []
-    source_text = ""
-    with open(sys.argv[1]) as source_file:
-        source_text = source_file.read()
-    lexer = Lexer(source_text)
+    engine = sys.argv[2] if len(sys.argv) > 2 else "regex"
+    if engine != "classic":
+        source_text = map_source(sys.argv[1])
+    else:
+        with open(sys.argv[1]) as source_file:
+            source_text = source_file.read()
+    lexer = Lexer(source_text, engine, stream=sys.argv[3:4] == ["stream"])
     token_list = lexer.lex()
     print("\n".join([str(x) for x in token_list]))
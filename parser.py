@@ -3,41 +3,108 @@
 import sys
 from dataclasses import dataclass
 from enum import Enum, auto
-from lex import Lexer, TokenType
+from lex import Lexer, TokenType, TERMINATOR_TYPES, mapped_source
 import pprint
-from astree import SymbolTable, ExprList, Expr, Name, Primary
+from astree import SymbolTable, ASTNode, ExprList, Expr, Name, Primary
 from astree import Literal, StringLiteral, IntLiteral, FloatLiteral, BoolLiteral, NullLiteral, ArrayLiteral, DictLiteral
 from astree import Call, Slice, Field, Accessor, AssignOp, AssignExpr
 from astree import BinOp, BinExpr, UnOp, UnExpr
 from astree import ReturnExpr, BreakExpr, LeaveExpr, ContinueExpr, DeferExpr, YieldExpr
-from astree import IfExpr, ElseExpr, Block, FnDecl, WhileExpr, DoWhileExpr, ForExpr
+from astree import IfExpr, ElseExpr, Block, LazyBlock, FnDecl, WhileExpr, DoWhileExpr, ForExpr
 from astree import ClassType, ClassDecl, MatchExpr, CaseExpr
 
+# token: (left binding power, right binding power, operator)
+BINARY_OPS = {
+    TokenType.OR: (1, 1, BinOp.OR),
+    TokenType.AND: (2, 2, BinOp.AND),
+    TokenType.GE: (4, 4, BinOp.GE),
+    TokenType.LE: (4, 4, BinOp.LE),
+    TokenType.GT: (4, 4, BinOp.GT),
+    TokenType.LT: (4, 4, BinOp.LT),
+    TokenType.EQUALEQUAL: (4, 4, BinOp.EQ),
+    TokenType.BANGEQUAL: (4, 4, BinOp.NE),
+    TokenType.OF: (4, 4, BinOp.OF),
+    TokenType.HAS: (4, 4, BinOp.HAS),
+    TokenType.PIPE: (5, 5, BinOp.BITOR),
+    TokenType.CARET: (6, 6, BinOp.BITXOR),
+    TokenType.AMP: (7, 7, BinOp.BITAND),
+    TokenType.LSHIFT: (8, 8, BinOp.LSHIFT),
+    TokenType.RSHIFT: (8, 8, BinOp.RSHIFT),
+    TokenType.PLUS: (9, 9, BinOp.ADD),
+    TokenType.MINUS: (9, 9, BinOp.SUB),
+    TokenType.STAR: (10, 10, BinOp.MUL),
+    TokenType.SLASH: (10, 10, BinOp.DIV),
+    TokenType.SLASHSLASH: (10, 10, BinOp.INTDIV),
+    TokenType.PERCENT: (10, 10, BinOp.MOD),
+    TokenType.STARSTAR: (12, 11, BinOp.EXP),
+}
+
+# token: (binding power of the operand, operator)
+PREFIX_OPS = {
+    TokenType.NOT: (3, UnOp.NOT),
+    TokenType.MINUS: (11, UnOp.NEG),
+    TokenType.PLUS: (11, UnOp.POS),
+    TokenType.TILDE: (11, UnOp.INV),
+}
+PREFIX_OPS_NOT = tuple(PREFIX_OPS)
+
+# names right after these tokens are never free variables of a function body
+LAZY_SKIP_AFTER = (TokenType.DOT, TokenType.FOR, TokenType.FN, TokenType.TO)
+PREFIX_OPS_UNARY = (TokenType.MINUS, TokenType.PLUS, TokenType.TILDE)
+
 class Parser:
-    def __init__(self, source):
-        self.lexer = Lexer(source)
+    def __init__(self, source, stream=False, names=None, lazy=False, offset=0, hashcons=False):
+        if stream and lazy:
+            raise Exception("Lazy function bodies need the whole token buffer")
+        self.lexer = Lexer(source, stream=stream, names=names, offset=offset)
+        self.lazy = lazy
+        self.nodes = {} if hashcons else None
+        self.consed = set()
 
     def parse(self):
         self.lexer.lex()
         return self.file()
 
+    def parse_iter(self):
+        self.lexer.lex()
+        return self.top_exprs()
+
     def getop(self, opdict):
         optok = self.lexer.next_token().ttype
         if optok not in opdict.keys():
             raise Exception("Expected operator from {}".format(opdict.keys()))
         return opdict[optok]
 
+    def cons(self, node, *key):
+        if self.nodes is None:
+            return node
+        for part in key:
+            if isinstance(part, ASTNode) and id(part) not in self.consed:
+                return node
+        key = (type(node),) + tuple(id(part) if isinstance(part, ASTNode) else part for part in key)
+        node = self.nodes.setdefault(key, node)
+        self.consed.add(id(node))
+        return node
+
+    def top_exprs(self):
+        while self.lexer.peek_type() != TokenType.EOF:
+            if self.nodes is not None:
+                # sharing stays within one statement so finished ones can be freed
+                self.nodes.clear()
+                self.consed.clear()
+            yield self.expr()
+
     def file(self):
         exprs = []
-        while self.lexer.peek().ttype != TokenType.EOF:
-            exprs.append(self.expr())
+        for expr in self.top_exprs():
+            exprs.append(expr)
             pprint.pp(exprs[-1])
         print("")
         return ExprList(exprs)
 
     def eat_terminators(self):
-        while self.lexer.peek().is_op(TokenType.NEWLINE, TokenType.SEMICOLON):
-            self.lexer.next_token()
+        if self.lexer.peek_type() in TERMINATOR_TYPES:
+            self.lexer.next_token(self.lexer.peek_significant())
 
     def expr(self):
         self.eat_terminators()
@@ -58,13 +125,10 @@ class Parser:
         return expr
 
     def match(self, *ttypes):
-        peek_distance = 0
-        if self.lexer.peek(peek_distance).ttype in ttypes:
-            self.lexer.next_token(peek_distance)
+        if self.lexer.peek_type() in ttypes:
             return True
-        while self.lexer.peek(peek_distance).ttype in [TokenType.NEWLINE, TokenType.SEMICOLON]:
-            peek_distance += 1
-        if self.lexer.peek(peek_distance).ttype in ttypes:
+        peek_distance = self.lexer.peek_significant()
+        if self.lexer.peek_type(peek_distance) in ttypes:
             self.lexer.next_token(peek_distance)
             return True
         return False
@@ -72,10 +136,9 @@ class Parser:
     def match_peek(self, *ttypes):
         peek_distance = 0
         for ttype in ttypes:
-            if self.lexer.peek(peek_distance).ttype != ttype:
-                while self.lexer.peek(peek_distance).ttype in [TokenType.NEWLINE, TokenType.SEMICOLON]:
-                    peek_distance += 1
-                if self.lexer.peek(peek_distance).ttype != ttype:
+            if self.lexer.peek_type(peek_distance) != ttype:
+                peek_distance = self.lexer.peek_significant(peek_distance)
+                if self.lexer.peek_type(peek_distance) != ttype:
                     return False
             peek_distance += 1
         return True
@@ -89,21 +152,13 @@ class Parser:
             return None
 
     def assignexpr(self):
-        backtrack = False
-        if self.lexer.peek().is_primary():
-            self.lexer.mark_backtrack()
+        if self.lexer.peek().is_primary() and not self.match_peek(TokenType.NAME, TokenType.COLON, TokenType.OPEN_BRACE):
             primary = self.primary()
-            if primary:
-                if self.match(TokenType.EQUAL):
-                    assignop = self.getop({TokenType.EQUAL: AssignOp.NORMAL})
-                    expr = self.req_expr()
-                    return AssignExpr(primary, assignop, expr)
-                else:
-                    backtrack = True
-            else:
-                backtrack = True
-        if backtrack:
-            self.lexer.backtrack()
+            if self.match(TokenType.EQUAL):
+                assignop = self.getop({TokenType.EQUAL: AssignOp.NORMAL})
+                expr = self.req_expr()
+                return AssignExpr(primary, assignop, expr)
+            return self.arith(primary)
         return self.nonassignexpr()
 
     def nonassignexpr(self):
@@ -252,9 +307,69 @@ class Parser:
                 raise Exception("Expected , or )")
             self.lexer.next_token()
         self.lexer.next_token()
+        if self.lazy:
+            self.eat_terminators()
+            if self.lexer.peek_type() == TokenType.OPEN_BRACE:
+                fnexpr = self.lazy_block()
+                self.eat_terminators()
+                return FnDecl(name, args, fnexpr)
         fnexpr = self.req_scope_expr()
         return FnDecl(name, args, fnexpr)
 
+    def lazy_block(self):
+        tokens = self.lexer.token_list
+        start = self.lexer.cur_token_pos
+        names = []
+        brace_depth = 0
+        square_depth = 0
+        paren_depth = 0
+        in_fn_header = False
+        prev_ttype = None
+        pos = start
+        while True:
+            ttype = tokens.ttype(pos)
+            if ttype == TokenType.EOF:
+                raise Exception("Expected }")
+            elif ttype == TokenType.OPEN_BRACE:
+                brace_depth += 1
+            elif ttype == TokenType.CLOSE_BRACE:
+                brace_depth -= 1
+                if brace_depth == 0:
+                    break
+            elif ttype == TokenType.OPEN_SQUARE:
+                square_depth += 1
+            elif ttype == TokenType.CLOSE_SQUARE:
+                square_depth -= 1
+            elif ttype == TokenType.FN:
+                in_fn_header = True
+            elif in_fn_header and ttype == TokenType.OPEN_PAREN:
+                paren_depth += 1
+            elif in_fn_header and ttype == TokenType.CLOSE_PAREN:
+                paren_depth -= 1
+                in_fn_header = paren_depth > 0
+            elif ttype == TokenType.NAME and not in_fn_header and square_depth == 0 \
+                    and prev_ttype not in LAZY_SKIP_AFTER:
+                next_ttype = tokens.ttype(tokens.significant(pos + 1))
+                label = next_ttype == TokenType.COLON and \
+                    tokens.ttype(tokens.significant(tokens.significant(pos + 1) + 1)) == TokenType.OPEN_BRACE
+                if next_ttype != TokenType.EQUAL and not label:
+                    name = tokens.lexeme(pos)
+                    if name not in names:
+                        names.append(name)
+            prev_ttype = ttype
+            pos += 1
+        self.lexer.seek(pos + 1)
+        return LazyBlock(start, pos + 1, names, self)
+
+    def parse_lazy(self, lazy_block):
+        resume_pos = self.lexer.cur_token_pos
+        self.lexer.seek(lazy_block.start)
+        body = self.block()
+        if self.lexer.cur_token_pos != lazy_block.end:
+            raise Exception("Function body did not end at its closing brace")
+        self.lexer.seek(resume_pos)
+        return body
+
     def classdecl(self):
         classtype = None
         if self.match(TokenType.CLASS):
@@ -306,114 +421,31 @@ class Parser:
         self.lexer.next_token()
         return Block(None, ExprList(exprs))
 
-    def arith(self):
-        return self.orexpr()
-
-    def orexpr(self):
-        lhs = self.andexpr()
-        while self.match(TokenType.OR):
-            op = self.getop({TokenType.OR: BinOp.OR})
-            rhs = self.andexpr()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def andexpr(self):
-        lhs = self.notexpr()
-        while self.match(TokenType.AND):
-            op = self.getop({TokenType.AND: BinOp.AND})
-            rhs = self.notexpr()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def notexpr(self):
-        if self.lexer.match(TokenType.NOT):
-            op = self.getop({TokenType.NOT: UnOp.NOT})
-            expr = self.notexpr()
-            return UnExpr(op, expr)
-        else:
-            return self.compexpr()
-
-    def compexpr(self):
-        lhs = self.bitor()
-        compops = {TokenType.GE: BinOp.GE, TokenType.LE: BinOp.LE,
-                   TokenType.GT: BinOp.GT, TokenType.LT: BinOp.LT,
-                   TokenType.EQUALEQUAL: BinOp.EQ, TokenType.BANGEQUAL: BinOp.NE,
-                   TokenType.OF: BinOp.OF, TokenType.HAS: BinOp.HAS}
-        while self.match(*compops.keys()):
-            op = self.getop(compops)
-            rhs = self.bitor()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def bitor(self):
-        lhs = self.bitxor()
-        while self.match(TokenType.PIPE):
-            op = self.getop({TokenType.PIPE: BinOp.BITOR})
-            rhs = self.bitxor()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def bitxor(self):
-        lhs = self.bitand()
-        while self.lexer.peek().ttype == TokenType.CARET:
-            op = self.getop({TokenType.CARET, BinOp.BITXOR})
-            rhs = self.bitand()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def bitand(self):
-        lhs = self.shiftexpr()
-        while self.match(TokenType.AMP):
-            op = self.getop({TokenType.AMP, BinOp.BITAND})
-            rhs = self.shiftexpr()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def shiftexpr(self):
-        lhs = self.sumexpr()
-        while self.match(TokenType.LSHIFT, TokenType.RSHIFT):
-            op = self.getop({TokenType.LSHIFT: BinOp.LSHIFT, TokenType.RSHIFT: BinOp.RSHIFT})
-            rhs = self.sumexpr()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def sumexpr(self):
-        lhs = self.termexpr()
-        while self.match(TokenType.PLUS, TokenType.MINUS):
-            op = self.getop({TokenType.PLUS: BinOp.ADD, TokenType.MINUS: BinOp.SUB})
-            rhs = self.termexpr()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def termexpr(self):
-        lhs = self.factorexpr()
-        while self.match(TokenType.STAR, TokenType.SLASH, TokenType.SLASHSLASH, TokenType.PERCENT):
-            op = self.getop({TokenType.STAR: BinOp.MUL, TokenType.SLASH: BinOp.DIV,
-                             TokenType.SLASHSLASH: BinOp.INTDIV,
-                             TokenType.PERCENT: BinOp.MOD})
-            rhs = self.factorexpr()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
-
-    def factorexpr(self):
-        if self.match(TokenType.MINUS, TokenType.PLUS, TokenType.TILDE):
-            op = self.getop({TokenType.MINUS: UnOp.NEG, TokenType.PLUS: UnOp.POS,
-                             TokenType.TILDE: UnOp.INV})
-            return UnExpr(op, self.factorexpr())
-        return self.powerexpr()
-
-    def powerexpr(self):
-        lhs = self.primary()
-        while self.match(TokenType.STARSTAR):
-            op = self.getop({TokenType.STARSTAR: BinOp.EXP})
-            rhs = self.factorexpr()
-            lhs = BinExpr(lhs, op, rhs)
-        return lhs
+    def arith(self, lhs=None):
+        return self.operexpr(0, lhs)
+
+    def operexpr(self, min_bp, lhs=None):
+        if lhs is None:
+            prefix_ops = PREFIX_OPS_NOT if min_bp <= PREFIX_OPS[TokenType.NOT][0] else PREFIX_OPS_UNARY
+            if self.match(*prefix_ops):
+                bp, op = PREFIX_OPS[self.lexer.next_token().ttype]
+                rhs = self.operexpr(bp)
+                lhs = self.cons(UnExpr(op, rhs), op, rhs)
+            else:
+                lhs = self.primary()
+        while True:
+            distance = self.lexer.peek_significant()
+            binop = BINARY_OPS.get(self.lexer.peek_type(distance))
+            if binop is None or binop[0] <= min_bp:
+                return lhs
+            self.lexer.next_token(distance + 1)
+            rhs = self.operexpr(binop[1])
+            lhs = self.cons(BinExpr(lhs, binop[2], rhs), lhs, binop[2], rhs)
 
     def primary(self):
         atom = self.atom()
         access = self.access()
-        return Primary(atom, access)
+        return self.cons(Primary(atom, access), atom, access)
 
     def atom(self):
         if self.match(TokenType.NAME):
@@ -444,22 +476,29 @@ class Parser:
         return expr
 
     def nameexpr(self):
-        return Name(self.lexer.next_token().lexeme)
+        token = self.lexer.next_token()
+        # names are never shared: the resolver stores a per-scope address on each one
+        return Name(token.lexeme)
 
     def litint(self):
-        return IntLiteral(int(self.lexer.next_token().lexeme, 0))
+        value = int(self.lexer.next_token().lexeme, 0)
+        return self.cons(IntLiteral(value), value)
 
     def litfloat(self):
-        return FloatLiteral(float(self.lexer.next_token().lexeme))
+        value = float(self.lexer.next_token().lexeme)
+        return self.cons(FloatLiteral(value), value)
 
     def litstring(self):
-        return StringLiteral(self.lexer.next_token().lexeme)
+        value = self.lexer.next_token().lexeme
+        return self.cons(StringLiteral(value), value)
 
     def litbool(self):
-        return BoolLiteral(self.lexer.next_token().lexeme == "true")
+        value = self.lexer.next_token().lexeme == "true"
+        return self.cons(BoolLiteral(value), value)
 
     def litnull(self):
-        return NullLiteral(None)
+        self.lexer.next_token()
+        return self.cons(NullLiteral(None), None)
 
     def litarray(self):
         arrayconst = ArrayLiteral
@@ -495,7 +534,7 @@ class Parser:
         return arrayconst(const_values)
 
     def access(self):
-        if self.lexer.peek().is_op(TokenType.OPEN_PAREN, TokenType.DOT, TokenType.OPEN_SQUARE):
+        if self.lexer.peek_type() in (TokenType.OPEN_PAREN, TokenType.DOT, TokenType.OPEN_SQUARE):
             if self.match(TokenType.OPEN_PAREN):
                 return Accessor(self.fncall(), self.access())
             elif self.match(TokenType.DOT):
@@ -529,9 +568,7 @@ class Parser:
 
 if __name__ == "__main__":
     expr_list = []
-    source_text = ""
-    with open(sys.argv[1]) as source_file:
-        source_text = source_file.read()
-    parser = Parser(source_text)
-    ast = parser.parse()
+    with mapped_source(sys.argv[1]) as source_text:
+        parser = Parser(source_text)
+        ast = parser.parse()
     print(ast.lprint())
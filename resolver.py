@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+from dataclasses import dataclass, field
+from astree import Name
+
+# No static candidates and the boundary at the current environment: a plain by-name walk
+DYNAMIC = ((), 0)
+
+@dataclass
+class Scope:
+    kind: str
+    names: list = field(default_factory=list)
+    index: dict = field(default_factory=dict)
+    resolved: bool = True
+
+    def declare(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        return self.index[name]
+
+def function_scope(args, body):
+    scope = Scope("function", resolved=False)
+    for arg in args:
+        scope.declare(arg)
+    for name in body.grab_primaries():
+        scope.declare(name)
+    return scope
+
+class Resolver:
+    def __init__(self, environment=None):
+        self.environment = environment
+        self.scopes = []
+        self.uses = []
+
+    def resolve(self, ast):
+        self.visit(ast)
+        self.finish()
+        return ast
+
+    def resolve_function(self, scope, body):
+        self.scopes.append(scope)
+        self.visit(body)
+        self.scopes.pop()
+        self.finish()
+        scope.resolved = True
+
+    def finish(self):
+        for name_ele, scopes in self.uses:
+            name = name_ele.name
+            depth = len(scopes)
+            candidates = tuple((depth - 1 - i, scopes[i].index[name])
+                               for i in range(depth - 1, -1, -1) if name in scopes[i].index)
+            address = (candidates, depth)
+            if name_ele.address is not None and name_ele.address != address:
+                address = DYNAMIC
+            name_ele.address = address
+        self.uses = []
+
+    def visit(self, node):
+        if node is not None:
+            node.visit(self)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def skip(node, **kwargs):
+            pass
+        return skip
+
+    def enter(self, kind):
+        scope = Scope(kind)
+        self.scopes.append(scope)
+        return scope
+
+    def leave(self):
+        self.scopes.pop()
+
+    def use(self, name_ele):
+        self.uses.append((name_ele, tuple(self.scopes)))
+
+    def is_global(self, name):
+        # Outside a function an assignment to a name the root environment already holds
+        # always lands there, so it never needs a slot of its own
+        return self.environment is not None and name in self.environment.symbols
+
+    def declare(self, name_ele):
+        if self.scopes and not self.is_global(name_ele.name):
+            self.scopes[-1].declare(name_ele.name)
+        self.use(name_ele)
+
+    def exprlist(self, exprlist_ele):
+        for expr in exprlist_ele.exprs:
+            self.visit(expr)
+
+    def block(self, block_ele):
+        block_ele.scope = self.enter("block")
+        self.visit(block_ele.exprs)
+        self.leave()
+
+    def name(self, name_ele):
+        self.use(name_ele)
+
+    def primary(self, primary_ele):
+        self.visit(primary_ele.target)
+        accessor = primary_ele.accessor
+        while accessor is not None:
+            self.visit(accessor.access_type)
+            accessor = accessor.next_accessor
+
+    def call(self, call_ele):
+        for arg in call_ele.args:
+            self.visit(arg)
+
+    def arraylit(self, array_ele):
+        for item in array_ele.value:
+            self.visit(item)
+
+    def dictlit(self, dict_ele):
+        for value in dict_ele.value.values():
+            self.visit(value)
+
+    def assign(self, assign_ele):
+        self.visit(assign_ele.expr)
+        target = assign_ele.target
+        if target.accessor is None and isinstance(target.target, Name):
+            self.declare(target.target)
+        else:
+            self.visit(target)
+
+    def binexpr(self, binexpr_ele):
+        self.visit(binexpr_ele.lhs)
+        self.visit(binexpr_ele.rhs)
+
+    def unexpr(self, unexpr_ele):
+        self.visit(unexpr_ele.rhs)
+
+    def ifexpr(self, ifexpr_ele):
+        self.visit(ifexpr_ele.guard)
+        self.visit(ifexpr_ele.expr)
+        self.visit(ifexpr_ele.elexpr)
+
+    def elseexpr(self, elseexpr_ele):
+        self.visit(elseexpr_ele.expr)
+
+    def forexpr(self, forexpr_ele):
+        self.visit(forexpr_ele.iter_expr)
+        forexpr_ele.scope = self.enter("loop")
+        forexpr_ele.scope.declare(forexpr_ele.iter_name.name)
+        self.visit(forexpr_ele.expr)
+        self.leave()
+        self.visit(forexpr_ele.elexpr)
+
+    def whileexpr(self, whileexpr_ele):
+        whileexpr_ele.scope = self.enter("loop")
+        self.visit(whileexpr_ele.guard)
+        self.visit(whileexpr_ele.expr)
+        self.leave()
+        self.visit(whileexpr_ele.elexpr)
+
+    def dowhileexpr(self, dowhileexpr_ele):
+        dowhileexpr_ele.scope = self.enter("loop")
+        self.visit(dowhileexpr_ele.expr)
+        self.visit(dowhileexpr_ele.guard)
+        self.leave()
+
+    def singlekwexpr(self, kw_ele):
+        self.visit(kw_ele.expr)
+
+    returnexpr = singlekwexpr
+    breakexpr = singlekwexpr
+    continueexpr = singlekwexpr
+    leaveexpr = singlekwexpr
+    deferexpr = singlekwexpr
+    yieldexpr = singlekwexpr
+
+    def fndecl(self, fndecl_ele):
+        if fndecl_ele.name is not None:
+            self.declare(fndecl_ele.name)
+        if fndecl_ele.scope is None:
+            args = [x.target.name for x in fndecl_ele.args]
+            fndecl_ele.scope = function_scope(args, fndecl_ele.expr)
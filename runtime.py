@@ -0,0 +1,360 @@
+import operator
+from dataclasses import dataclass, field
+from astree import ASTNode, BinOp, UnOp
+from resolver import Resolver
+
+class Unbound:
+    def __repr__(self):
+        return "<unbound>"
+
+UNBOUND = Unbound()
+
+@dataclass
+class FSObject:
+    name: 'str'
+    fsclass: 'FSObject' = None
+    parents: list = field(default_factory=list)
+    fields: 'Environment' = field(default_factory=dict)
+    instance_fields: 'Environment' = field(default_factory=dict)
+    call: 'FSFunc' = None
+    operators: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.fsclass is None:
+            self.fsclass = self
+
+    def __str__(self):
+        return str(self.fields["value"]) if "value" in self.fields.keys() else self.name
+
+    def __repr__(self):
+        return self.__str__()
+
+FUNCTION = "function"
+LOOP = "loop"
+
+class Environment:
+    # One activation record: a block, loop or call. Names the resolver gave a slot live in
+    # slots, anything else (globals, closure captures, dynamic bindings) in the symbols dict,
+    # which is only allocated for frames that need it. Defers are allocated on first use.
+    __slots__ = ("enclosing", "scope", "slots", "symbols", "kind", "label",
+                 "break_called", "defer_exprs", "in_assign", "lit_num")
+
+    def __init__(self, enclosing=None, scope=None, kind=None, label=None, slots=None, in_assign=False):
+        self.enclosing = enclosing
+        self.scope = scope
+        if scope is None:
+            self.slots = None
+            self.symbols = {}
+        else:
+            self.slots = [UNBOUND] * len(scope.names) if slots is None else slots
+            self.symbols = None
+        self.kind = kind
+        self.label = label
+        self.break_called = False
+        self.defer_exprs = None
+        self.in_assign = in_assign
+        self.lit_num = 0
+
+    def __repr__(self):
+        return "Environment(symbols={}, slots={})".format(self.symbols, self.slots)
+
+    def get(self, name, can_fail=False):
+        env = self
+        while env is not None:
+            symbols = env.symbols
+            if symbols is not None and name in symbols:
+                return symbols[name]
+            scope = env.scope
+            if scope is not None:
+                slot = scope.index.get(name)
+                if slot is not None and env.slots[slot] is not UNBOUND:
+                    return env.slots[slot]
+            env = env.enclosing
+        if not can_fail:
+            raise Exception("No name " + name)
+        return None
+
+    def assign(self, name, value, immediate=False):
+        if immediate or self.enclosing is None or not self.assign_if(name, value):
+            self.bind(name, value)
+        return value
+
+    def assign_if(self, name, value):
+        env = self
+        while env is not None:
+            symbols = env.symbols
+            if symbols is not None and name in symbols:
+                symbols[name] = value
+                return True
+            scope = env.scope
+            if scope is not None:
+                slot = scope.index.get(name)
+                if slot is not None and env.slots[slot] is not UNBOUND:
+                    env.slots[slot] = value
+                    return True
+            env = env.enclosing
+        return False
+
+    def bind(self, name, value):
+        if self.scope is not None:
+            slot = self.scope.index.get(name)
+            if slot is not None:
+                self.slots[slot] = value
+                return value
+        if self.symbols is None:
+            self.symbols = {}
+        self.symbols[name] = value
+        return value
+
+    def lookup(self, name, address):
+        candidates, boundary = address
+        env = self
+        depth = 0
+        for hops, slot in candidates:
+            while depth < hops:
+                env = env.enclosing
+                depth += 1
+            value = env.slots[slot]
+            if value is not UNBOUND:
+                return value
+        while depth < boundary:
+            env = env.enclosing
+            depth += 1
+        return env.get(name)
+
+    def store(self, name, value, address):
+        candidates, boundary = address
+        env = self
+        depth = 0
+        for hops, slot in candidates:
+            while depth < hops:
+                env = env.enclosing
+                depth += 1
+            if env.slots[slot] is not UNBOUND:
+                env.slots[slot] = value
+                return value
+        while depth < boundary:
+            env = env.enclosing
+            depth += 1
+        if not env.assign_if(name, value):
+            self.bind(name, value)
+        return value
+
+    def get_lit_num(self):
+        if self.enclosing:
+            return self.enclosing.get_lit_num()
+        ret_num = self.lit_num
+        self.lit_num += 1
+        return ret_num
+
+    def descend(self, scope=None, kind=None, label=None):
+        return Environment(self, scope, kind, label, in_assign=self.in_assign)
+
+    def ascend(self):
+        return self.enclosing
+
+    def do_break(self, label=None, height=0):
+        self.break_called = True
+        if label is not None:
+            if self.label != label and self.enclosing is not None:
+                self.enclosing.do_break(label=label)
+            else:
+                raise Exception("No labeled block " + label)
+        elif self.enclosing is not None and self.kind != LOOP:
+            self.enclosing.do_break(label=label, height=height+1)
+
+    def do_leave(self, label=None):
+        self.break_called = True
+        if label is not None:
+            if self.label != label and self.enclosing is not None:
+                self.enclosing.do_leave(label=label)
+            else:
+                raise Exception("No labeled block " + label)
+
+    def do_return(self):
+        self.break_called = True
+        if self.enclosing is not None and self.kind != FUNCTION:
+            self.enclosing.do_return()
+
+    def add_defer(self, expr):
+        if self.defer_exprs is None:
+            self.defer_exprs = []
+        self.defer_exprs.insert(0, expr)
+
+    def push_assign(self):
+        self.in_assign = True
+
+    def pop_assign(self):
+        self.in_assign = False
+
+@dataclass
+class FSFunc:
+    args: list
+    body: ASTNode
+    closure: 'Environment' = field(default_factory=Environment)
+    code: None = field(default=None, repr=False, compare=False)
+    scope: None = field(default=None, repr=False, compare=False)
+    template: list = field(default=None, init=False, repr=False, compare=False)
+    arg_slots: list = field(default=None, init=False, repr=False, compare=False)
+
+    def enter(self, call_args, environment):
+        if len(call_args) != len(self.args):
+            raise Exception("Arg numbers mismatch")
+        if self.scope is None:
+            frame = environment.descend(kind=FUNCTION)
+            for symbol_name, symbol_val in self.closure.symbols.items():
+                frame.bind(symbol_name, symbol_val)
+            for name, value in zip(self.args, call_args):
+                frame.bind(name, value)
+            return frame
+        if self.template is None:
+            self.prepare()
+        slots = self.template[:]
+        for slot, value in zip(self.arg_slots, call_args):
+            slots[slot] = value
+        return Environment(environment, self.scope, FUNCTION, slots=slots, in_assign=environment.in_assign)
+
+    def prepare(self):
+        # Lay the captured values out once; each call then only copies this list and fills in the args
+        if not self.scope.resolved:
+            Resolver().resolve_function(self.scope, self.body)
+        index = self.scope.index
+        template = [UNBOUND] * len(self.scope.names)
+        for symbol_name, symbol_val in self.closure.symbols.items():
+            template[index[symbol_name]] = symbol_val
+        self.arg_slots = [index[name] for name in self.args]
+        self.template = template
+
+    def call(self, call_args, interp):
+        interp.environment = self.enter(call_args, interp.environment)
+        ret = self.body.visit(interp)
+        interp.environment = interp.environment.ascend()
+        return ret
+
+class InterpreterQuitException(Exception):
+    pass
+
+def interpreter_quit():
+    raise InterpreterQuitException()
+
+@dataclass
+class Call:
+    args: list
+
+    def apply(self, callee, interp):
+        ret = None
+        if isinstance(callee, FSFunc):
+            ret = callee.call(self.args, interp)
+        else:
+            ret = callee(*[box(interp.environment, arg) for arg in self.args])
+        return ret
+
+@dataclass
+class Field:
+    field: str
+
+@dataclass
+class Slice:
+    slices: list
+
+@dataclass
+class Name:
+    name: str
+
+    def get(self, environment):
+        return environment.get(self.name)
+
+@dataclass
+class Literal:
+    value: None
+
+    def get(self, environment):
+        return self.value
+
+@dataclass
+class Primary:
+    target: None
+    accessors: None
+
+    def get(self, environment):
+        ret = self.target.get(environment)
+        if self.accessors:
+            for accessor in self.accessors:
+                ret = accessor.apply(ret, environment)
+        return ret
+
+def prelude():
+    environment = Environment()
+    environment.assign("print", print)
+    environment.assign("object", FSObject("object"))
+    environment.assign("null", FSObject("null"))
+    environment.assign("class", FSObject("class", parents=[environment.get("object")]))
+    environment.assign("number", FSObject("number", parents=[environment.get("object")], fsclass=environment.get("class")))
+    environment.assign("int", FSObject("int", parents=[environment.get("number")], fsclass=environment.get("class")))
+    environment.assign("float", FSObject("float", parents=[environment.get("number")], fsclass=environment.get("class")))
+    environment.assign("bool", FSObject("bool", parents=[environment.get("object")], fsclass=environment.get("class")))
+    environment.assign("true", FSObject("true", parents=[environment.get("bool")], fsclass=environment.get("class")))
+    environment.assign("false", FSObject("false", parents=[environment.get("bool")], fsclass=environment.get("class")))
+    environment.assign("collection", FSObject("collection", parents=[environment.get("object")], fsclass=environment.get("class")))
+    environment.assign("dict", FSObject("dict", parents=[environment.get("collection")], fsclass=environment.get("class")))
+    environment.assign("array", FSObject("array", parents=[environment.get("collection")], fsclass=environment.get("class")))
+    environment.assign("str", FSObject("str", parents=[environment.get("collection")], fsclass=environment.get("class")))
+    return environment
+
+def literal_literal(environment, literal_val, literal_type):
+    return FSObject("{}_lit_{}".format(literal_type, environment.get_lit_num()),
+                    fsclass=environment.get(literal_type),
+                    fields={"value": literal_val})
+
+BINARY_FUNCS = {
+    BinOp.ADD: operator.add,
+    BinOp.SUB: operator.sub,
+    BinOp.EXP: operator.pow,
+    BinOp.MUL: operator.mul,
+    BinOp.DIV: operator.truediv,
+    BinOp.INTDIV: operator.floordiv,
+    BinOp.MOD: operator.mod,
+    BinOp.LSHIFT: operator.lshift,
+    BinOp.RSHIFT: operator.rshift,
+    BinOp.BITAND: operator.and_,
+    BinOp.BITXOR: operator.xor,
+    BinOp.BITOR: operator.or_,
+    BinOp.EQ: operator.eq,
+    BinOp.NE: operator.ne,
+    BinOp.GT: operator.gt,
+    BinOp.LT: operator.lt,
+    BinOp.GE: operator.ge,
+    BinOp.LE: operator.le,
+}
+
+UNARY_FUNCS = {
+    UnOp.NEG: operator.neg,
+    UnOp.POS: operator.pos,
+    UnOp.INV: operator.invert,
+    UnOp.NOT: operator.not_,
+}
+
+# Inside the engines ints, floats and bools are plain Python values. They are boxed into
+# FSObjects only when they leave the engine: stored in an array or dict, or passed to a host
+# function such as print.
+def box(environment, res):
+    if res is True:
+        return environment.get("true")
+    elif res is False:
+        return environment.get("false")
+    elif isinstance(res, float):
+        return literal_literal(environment, res, "float")
+    elif isinstance(res, int):
+        return literal_literal(environment, res, "int")
+    return res
+
+def unbox(value):
+    if value.__class__ is FSObject:
+        if value.fsclass.name == "int" or value.fsclass.name == "float":
+            return value.fields["value"]
+        if value.parents and value.parents[0].name == "bool":
+            return value.name == "true"
+    return value
+
+def value_of(value):
+    return value.fields["value"] if value.__class__ is FSObject else value
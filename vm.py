@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import sys
+from runtime import FSFunc, FSObject, Environment, UNBOUND, box, unbox, value_of, literal_literal
+from bytecode import Compiler, FunctionProto, BINARY_OPS, UNARY_OPS
+from bytecode import (LOAD_CONST, LOAD_LOCAL, STORE_LOCAL, BIND_LOCAL, LOAD_GLOBAL, STORE_GLOBAL,
+                      POP, POP_TO, JUMP, POP_JUMP_IF_NOT_TRUE, AND_TEST, OR_TEST, VALUE_OF,
+                      BINARY_OP, UNARY_OP, GET_ITER, FOR_START, FOR_NEXT, CALL, BUILD_ARRAY,
+                      BUILD_DICT, MAKE_FUNCTION, DEFER, RUN_DEFERS, END_DEFER, RETURN, RAISE)
+
+class Frame:
+    __slots__ = ("code", "slots", "stack", "parent", "pc", "returns")
+
+    def __init__(self, code, parent):
+        self.code = code
+        self.slots = code.initial[:]
+        self.stack = []
+        self.parent = parent
+        self.pc = 0
+        self.returns = []
+
+class VM:
+    def __init__(self, environment):
+        self.environment = environment
+
+    def compile(self, ast):
+        return Compiler(self.environment).compile(ast)
+
+    def lookup(self, frame, name, can_fail=False):
+        while frame is not None:
+            slot = frame.code.local_index.get(name)
+            if slot is not None and frame.slots[slot] is not UNBOUND:
+                return frame.slots[slot]
+            frame = frame.parent
+        return self.environment.get(name, can_fail=can_fail)
+
+    def assign_if(self, frame, name, value):
+        while frame is not None:
+            slot = frame.code.local_index.get(name)
+            if slot is not None and frame.slots[slot] is not UNBOUND:
+                frame.slots[slot] = value
+                return True
+            frame = frame.parent
+        return self.environment.assign_if(name, value)
+
+    def make_function(self, proto, frame):
+        closure = Environment()
+        for name in proto.captures:
+            value = self.lookup(frame, name, can_fail=True)
+            if value is not None:
+                closure.symbols[name] = value
+        return FSFunc(proto.args, proto.body, closure, proto)
+
+    def enter(self, func, args, parent):
+        if len(args) != len(func.args):
+            raise Exception("Arg numbers mismatch")
+        proto = func.code
+        if not isinstance(proto, FunctionProto):
+            proto = func.code = FunctionProto(None, func.args, func.body, func.body.grab_primaries())
+        code = proto.compile(self.environment)
+        frame = Frame(code, parent)
+        slots = frame.slots
+        local_index = code.local_index
+        for name, value in func.closure.symbols.items():
+            slots[local_index[name]] = value
+        for slot, value in zip(code.arg_slots, args):
+            slots[slot] = value
+        return frame
+
+    def run(self, code):
+        environment = self.environment
+        frame = Frame(code, None)
+        ops = code.ops
+        consts = code.consts
+        slots = frame.slots
+        stack = frame.stack
+        pc = 0
+        while True:
+            op = ops[pc]
+            arg = ops[pc + 1]
+            pc += 2
+            if op == LOAD_LOCAL:
+                value = slots[arg]
+                if value is UNBOUND:
+                    value = self.lookup(frame.parent, code.local_names[arg])
+                stack.append(value)
+            elif op == LOAD_CONST:
+                stack.append(consts[arg])
+            elif op == BINARY_OP:
+                rhs = stack.pop()
+                if rhs.__class__ is FSObject:
+                    rhs = rhs.fields["value"]
+                lhs = stack[-1]
+                if lhs.__class__ is FSObject:
+                    lhs = lhs.fields["value"]
+                stack[-1] = BINARY_OPS[arg](lhs, rhs)
+            elif op == POP_JUMP_IF_NOT_TRUE:
+                if stack.pop() is not True:
+                    pc = arg
+            elif op == POP:
+                stack.pop()
+            elif op == STORE_LOCAL:
+                if slots[arg] is not UNBOUND or not self.assign_if(frame.parent, code.local_names[arg], stack[-1]):
+                    slots[arg] = stack[-1]
+            elif op == JUMP:
+                pc = arg
+            elif op == LOAD_GLOBAL:
+                stack.append(environment.get(code.names[arg]))
+            elif op == STORE_GLOBAL:
+                environment.symbols[code.names[arg]] = stack[-1]
+            elif op == CALL:
+                args = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                func = stack.pop()
+                if not isinstance(func, FSFunc):
+                    stack.append(func(*[box(environment, arg) for arg in args]))
+                    continue
+                frame.pc = pc
+                frame = self.enter(func, args, frame)
+                code = frame.code
+                ops = code.ops
+                consts = code.consts
+                slots = frame.slots
+                stack = frame.stack
+                pc = 0
+            elif op == RETURN:
+                value = stack.pop()
+                if frame.parent is None:
+                    if arg:
+                        environment.break_called = True
+                    return value
+                frame = frame.parent
+                code = frame.code
+                ops = code.ops
+                consts = code.consts
+                slots = frame.slots
+                stack = frame.stack
+                pc = frame.pc
+                stack.append(value)
+            elif op == BIND_LOCAL:
+                slots[arg] = stack.pop()
+            elif op == FOR_NEXT:
+                value = stack.pop()
+                item = next(stack[-1], UNBOUND)
+                if item is UNBOUND:
+                    stack[-1] = value
+                else:
+                    stack.append(item)
+                    pc = arg
+            elif op == FOR_START:
+                item = next(stack[-1], UNBOUND)
+                if item is UNBOUND:
+                    stack.pop()
+                    pc = arg
+                else:
+                    stack.append(item)
+            elif op == GET_ITER:
+                stack[-1] = map(unbox, stack[-1].fields["value"])
+            elif op == UNARY_OP:
+                stack[-1] = UNARY_OPS[arg](value_of(stack[-1]))
+            elif op == AND_TEST:
+                value = value_of(stack[-1])
+                if value is True:
+                    stack.pop()
+                else:
+                    stack[-1] = value
+                    pc = arg
+            elif op == OR_TEST:
+                value = value_of(stack[-1])
+                if value is False:
+                    stack.pop()
+                else:
+                    stack[-1] = value
+                    pc = arg
+            elif op == VALUE_OF:
+                stack[-1] = value_of(stack[-1])
+            elif op == POP_TO:
+                value = stack.pop()
+                del stack[arg:]
+                stack.append(value)
+            elif op == BUILD_ARRAY:
+                items = stack[len(stack) - arg:]
+                del stack[len(stack) - arg:]
+                stack.append(literal_literal(environment, [box(environment, item) for item in items], "array"))
+            elif op == BUILD_DICT:
+                keys = consts[arg]
+                values = stack[len(stack) - len(keys):]
+                del stack[len(stack) - len(keys):]
+                stack.append(literal_literal(environment, {key: box(environment, value) for key, value in zip(keys, values)}, "dict"))
+            elif op == MAKE_FUNCTION:
+                stack.append(self.make_function(consts[arg], frame))
+            elif op == DEFER:
+                if slots[arg] is None:
+                    slots[arg] = []
+                slots[arg].append(pc + 2)
+            elif op == RUN_DEFERS:
+                defers = slots[arg]
+                if defers:
+                    stack.pop()
+                    frame.returns.append(pc - 2)
+                    pc = defers.pop()
+            elif op == END_DEFER:
+                pc = frame.returns.pop()
+            elif op == RAISE:
+                raise Exception(consts[arg])
+            else:
+                raise Exception("Unknown opcode {}".format(op))
+
+if __name__ == "__main__":
+    from interp import Interpreter
+    interp = Interpreter("vm")
+    interp.interpret(interp.parse_file(sys.argv[1]))